@@ -19,6 +19,10 @@ def main():
 
     print("Starting analysis...")
 
+    # Run the analysis once; the report, export and detailed summary below
+    # all reuse the engine's cached result
+    analysis = engine.analyze_tracking_behavior()
+
     # Generate report
     if args.format == 'html':
         report = engine.generate_report(format='html')
@@ -28,7 +32,6 @@ def main():
         print(f"HTML report generated: {output_file}")
 
     elif args.format == 'json':
-        analysis = engine.analyze_tracking_behavior()
         output_file = args.output or f'tracking_analysis_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
         engine.export_data(format='json', filepath=output_file)
         print(f"JSON analysis exported: {output_file}")
@@ -45,7 +48,6 @@ def main():
 
     # Generate detailed analysis if requested
     if args.detailed:
-        analysis = engine.analyze_tracking_behavior()
         print("\nDetailed Analysis Summary:")
         print("-" * 50)
         print(
@@ -58,6 +60,8 @@ def main():
         for rec in analysis['recommendations'][:3]:
             print(f"- [{rec['priority']}] {rec['description']}")
 
+    engine.close()
+
 
 if __name__ == "__main__":
     main()
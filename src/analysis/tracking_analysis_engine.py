@@ -1,14 +1,102 @@
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 import pandas as pd
 import numpy as np
 from urllib.parse import urlparse
 import networkx as nx
-from collections import defaultdict
+from collections import Counter
+from functools import lru_cache
+from string import Template
 import matplotlib.pyplot as plt
 from typing import Dict, List, Any, Tuple
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
+
+def _json_default(obj):
+    """Serialize the non-JSON types the analysis dict carries"""
+    if isinstance(obj, set):
+        return sorted(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj, default=_json_default,
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode()
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, indent=2, default=_json_default)
+
+
+@lru_cache(maxsize=65536)
+def _netloc(url: str) -> str:
+    """Host part of a URL; requests to the same tracker repeat heavily"""
+    return urlparse(url).netloc
+
+
+def _read_frame(sql: str, conn: sqlite3.Connection, params=None) -> pd.DataFrame:
+    """Read a query into a DataFrame, keeping SQL NULLs as None rather than NaN"""
+    # Nullable dtypes keep integer columns integral when they hold NULLs
+    df = pd.read_sql_query(sql, conn, params=params, dtype_backend='numpy_nullable')
+    return df.astype(object).where(df.notna(), None)
+
+
+# string.Template rather than str.format: the inline CSS is full of braces
+_HTML_TEMPLATE = Template("""\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Web Tracking Analysis Report</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .section { margin: 20px 0; padding: 10px; border: 1px solid #ccc; }
+        .high-risk { color: #d9534f; }
+        .medium-risk { color: #f0ad4e; }
+        .low-risk { color: #5bc0de; }
+    </style>
+</head>
+<body>
+    <h1>Web Tracking Analysis Report</h1>
+    <div class="section">
+        <h2>Summary</h2>
+        <p>Total Trackers: $total_trackers</p>
+        <p>Risk Score: $risk_score/100</p>
+    </div>
+    <!-- Add more sections -->
+</body>
+</html>
+""")
+
+# Indexes backing the engine's predicates, created once per database
+_INDEXES = {
+    'cookie': '''
+        CREATE INDEX IF NOT EXISTS idx_cookies_name ON cookies(name);
+    ''',
+    'storage': '''
+        CREATE INDEX IF NOT EXISTS idx_ls_key ON local_storage(key);
+    ''',
+    'network': '''
+        CREATE INDEX IF NOT EXISTS idx_req_tp ON requests(third_party, domain);
+    ''',
+    'javascript': '''
+        CREATE INDEX IF NOT EXISTS idx_js_fn ON js_activities(function_name);
+    '''
+}
+
+
 class TrackingAnalysisEngine:
     def __init__(self,
                  cookie_db="cookie_monitor.db",
@@ -23,6 +111,61 @@ class TrackingAnalysisEngine:
             'javascript': js_db
         }
         self.tracking_patterns = self._load_tracking_patterns()
+        self._build_queries()
+        self._analysis_cache = None
+        self._cross_domain_cache = None
+        self._frames = {}
+        self._conns = {}
+        self._conns_lock = threading.Lock()
+        self._indexed = set()
+
+    def _conn(self, name: str) -> sqlite3.Connection:
+        """Return this thread's connection to a monitor database, opening it on first use"""
+        key = (name, threading.get_ident())
+        conn = self._conns.get(key)
+        if conn is None:
+            conn = sqlite3.connect(self.databases[name],
+                                   check_same_thread=False,
+                                   isolation_level=None)
+            # The engine only reads, so tune for large cached scans and
+            # refuse writes once the indexes are in place
+            conn.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA cache_size=-65536;
+                PRAGMA mmap_size=268435456;
+                PRAGMA temp_store=MEMORY;
+            ''')
+            with self._conns_lock:
+                # Retried on later connections until the monitor has
+                # created its tables
+                if name not in self._indexed and self._ensure_indexes(conn, name):
+                    self._indexed.add(name)
+                self._conns[key] = conn
+            conn.execute('PRAGMA query_only=1')
+        return conn
+
+    def _ensure_indexes(self, conn: sqlite3.Connection, name: str) -> bool:
+        """Create the indexes the analysis queries rely on, if the table exists yet"""
+        try:
+            conn.executescript(_INDEXES[name])
+        except sqlite3.OperationalError as e:
+            print(f"Could not index {self.databases[name]}: {str(e)}")
+            return False
+        return True
+
+    def close(self):
+        """Close all open database connections"""
+        with self._conns_lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+
+    def invalidate(self):
+        """Drop cached analysis results so the next call re-reads the databases"""
+        self._analysis_cache = None
+        self._cross_domain_cache = None
+        self._frames = {}
 
     def _load_tracking_patterns(self) -> Dict[str, List[str]]:
         """Load known tracking patterns and identifiers"""
@@ -45,19 +188,80 @@ class TrackingAnalysisEngine:
             ]
         }
 
+    def _build_queries(self):
+        """Build the pattern-dependent SQL once instead of on every analysis call"""
+        self._cookie_filter, self._cookie_params = self._pattern_filter(
+            'name', self.tracking_patterns['cookie_names'])
+        self._cookie_count_sql = '''
+            SELECT COUNT(*), COUNT(DISTINCT domain)
+            FROM cookies''' + self._cookie_filter
+        self._cookie_sql = '''
+            SELECT name, domain, value, creation_time AS created, expires, is_session
+            FROM cookies''' + self._cookie_filter
+
+        storage_filter, self._storage_params = self._pattern_filter(
+            'key', self.tracking_patterns['storage_keys'])
+        self._storage_sql = '''
+            SELECT domain, key, value, timestamp
+            FROM local_storage''' + storage_filter
+
+        self._javascript_sql = '''
+            SELECT script_url AS script, function_name AS function,
+                arguments AS args, timestamp
+            FROM js_activities
+            WHERE function_name IN (''' + ','.join(['?'] * len(self.tracking_patterns['suspicious_apis'])) + ')'
+        self._fingerprint_calls_sql = '''
+            SELECT EXISTS (
+                SELECT 1 FROM js_activities
+                WHERE function_name IN (''' + ','.join(['?'] * len(self.tracking_patterns['suspicious_apis'])) + '''))'''
+
+    def _pattern_filter(self, column: str, names: List[str],
+                        substrings: Tuple[str, ...] = ('track', 'id')) -> Tuple[str, List[str]]:
+        """Build a WHERE clause matching tracking substrings or exact names.
+
+        The substring LIKEs already force a single scan, so exact names they
+        would match anyway (LIKE is case-insensitive for ASCII) are dropped
+        from the IN list rather than re-tested on every row.
+        """
+        exact = [n for n in names
+                 if not any(sub in n.lower() for sub in substrings)]
+        clauses = [f"{column} LIKE '%{sub}%'" for sub in substrings]
+        if exact:
+            clauses.append(f"{column} IN (" + ','.join(['?'] * len(exact)) + ')')
+        return '\n            WHERE ' + '\n                OR '.join(clauses), exact
+
+    def _is_empty(self, name: str, table: str) -> bool:
+        """Check whether a monitor recorded nothing (or never created its table)"""
+        try:
+            row = self._conn(name).execute(
+                f'SELECT 1 FROM {table} LIMIT 1').fetchone()
+        except sqlite3.OperationalError:
+            return True
+        return row is None
+
     def analyze_tracking_behavior(self) -> Dict[str, Any]:
         """Perform comprehensive analysis of tracking behavior"""
-        analysis = {
-            'summary': self._generate_summary(),
-            'cookie_analysis': self._analyze_cookies(),
-            'storage_analysis': self._analyze_storage(),
-            'network_analysis': self._analyze_network(),
-            'javascript_analysis': self._analyze_javascript(),
-            'cross_domain_tracking': self._analyze_cross_domain_tracking(),
-            'fingerprinting_detection': self._detect_fingerprinting(),
-            'privacy_risks': self._assess_privacy_risks(),
-            'recommendations': self._generate_recommendations()
+        if self._analysis_cache is not None:
+            return self._analysis_cache
+
+        # The monitor databases are independent files, so the per-source
+        # analyses can read them in parallel
+        tasks = {
+            'cookie_analysis': self._analyze_cookies,
+            'storage_analysis': self._analyze_storage,
+            'network_analysis': self._analyze_network,
+            'javascript_analysis': self._analyze_javascript,
+            'cross_domain_tracking': self._analyze_cross_domain_tracking,
+            'fingerprinting_detection': self._detect_fingerprinting
         }
+        with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+            futures = {key: pool.submit(task) for key, task in tasks.items()}
+            analysis = {'summary': self._generate_summary()}
+
+        analysis.update((key, future.result()) for key, future in futures.items())
+        analysis['privacy_risks'] = self._assess_privacy_risks()
+        analysis['recommendations'] = self._generate_recommendations()
+        self._analysis_cache = analysis
         return analysis
 
     def _generate_summary(self) -> Dict[str, Any]:
@@ -65,25 +269,17 @@ class TrackingAnalysisEngine:
         summary = {
             'timestamp': datetime.now(),
             'total_trackers': 0,
-            'tracking_methods': defaultdict(int),
+            'tracking_methods': Counter(),
             'high_risk_activities': [],
             'domains_involved': set()
         }
 
         # Analyze cookies
-        conn = sqlite3.connect(self.databases['cookie'])
-        c = conn.cursor()
+        c = self._conn('cookie').cursor()
 
-        c.execute('''
-            SELECT COUNT(*), COUNT(DISTINCT domain)
-            FROM cookies
-            WHERE name LIKE '%track%'
-                OR name LIKE '%id%'
-                OR name IN (''' + ','.join(['?']*len(self.tracking_patterns['cookie_names'])) + ')',
-            self.tracking_patterns['cookie_names']
-        )
+        c.execute(self._cookie_count_sql, self._cookie_params)
         tracking_cookies, cookie_domains = c.fetchone()
-        summary['tracking_methods']['cookies'] = tracking_cookies
+        summary['tracking_methods'].update(cookies=tracking_cookies)
         summary['domains_involved'].update(self._get_cookie_domains())
 
         # Similar analysis for other tracking methods
@@ -93,7 +289,7 @@ class TrackingAnalysisEngine:
 
     def _analyze_cookies(self) -> Dict[str, Any]:
         """Analyze cookie-based tracking patterns"""
-        conn = sqlite3.connect(self.databases['cookie'])
+        conn = self._conn('cookie')
         c = conn.cursor()
 
         analysis = {
@@ -102,27 +298,13 @@ class TrackingAnalysisEngine:
             'synced_cookies': [],
             'persistent_cookies': []
         }
+        if self._is_empty('cookie', 'cookies'):
+            return analysis
 
         # Identify tracking cookies
-        c.execute('''
-            SELECT name, domain, value, creation_time, expires, is_session
-            FROM cookies
-            WHERE name LIKE '%track%'
-                OR name LIKE '%id%'
-                OR name IN (''' + ','.join(['?']*len(self.tracking_patterns['cookie_names'])) + ')',
-            self.tracking_patterns['cookie_names']
-        )
-
-        for row in c.fetchall():
-            cookie = {
-                'name': row[0],
-                'domain': row[1],
-                'value': row[2],
-                'created': row[3],
-                'expires': row[4],
-                'is_session': row[5]
-            }
-            analysis['tracking_cookies'].append(cookie)
+        df = _read_frame(self._cookie_sql, conn, params=self._cookie_params)
+        self._frames['tracking_cookies'] = df
+        analysis['tracking_cookies'] = df.to_dict(orient='records')
 
         # Detect cookie respawning
         analysis['respawned_cookies'] = self._detect_cookie_respawning(c)
@@ -134,7 +316,7 @@ class TrackingAnalysisEngine:
 
     def _analyze_storage(self) -> Dict[str, Any]:
         """Analyze storage-based tracking"""
-        conn = sqlite3.connect(self.databases['storage'])
+        conn = self._conn('storage')
         c = conn.cursor()
 
         analysis = {
@@ -143,25 +325,13 @@ class TrackingAnalysisEngine:
             'backup_data': [],
             'fingerprinting_storage': []
         }
+        if self._is_empty('storage', 'local_storage'):
+            return analysis
 
         # Analyze localStorage usage
-        c.execute('''
-            SELECT domain, key, value, timestamp
-            FROM local_storage
-            WHERE key LIKE '%track%'
-                OR key LIKE '%id%'
-                OR key IN (''' + ','.join(['?']*len(self.tracking_patterns['storage_keys'])) + ')',
-            self.tracking_patterns['storage_keys']
-        )
-
-        for row in c.fetchall():
-            storage_item = {
-                'domain': row[0],
-                'key': row[1],
-                'value': row[2],
-                'timestamp': row[3]
-            }
-            analysis['localStorage_tracking'].append(storage_item)
+        df = _read_frame(self._storage_sql, conn, params=self._storage_params)
+        self._frames['localStorage_tracking'] = df
+        analysis['localStorage_tracking'] = df.to_dict(orient='records')
 
         # Analyze fingerprinting data in storage
         analysis['fingerprinting_storage'] = self._detect_storage_fingerprinting(c)
@@ -170,7 +340,7 @@ class TrackingAnalysisEngine:
 
     def _analyze_network(self) -> Dict[str, Any]:
         """Analyze network-based tracking"""
-        conn = sqlite3.connect(self.databases['network'])
+        conn = self._conn('network')
         c = conn.cursor()
 
         analysis = {
@@ -179,25 +349,21 @@ class TrackingAnalysisEngine:
             'beacon_usage': [],
             'suspicious_endpoints': []
         }
+        if self._is_empty('network', 'requests'):
+            return analysis
 
         # Analyze tracking requests
-        c.execute('''
-            SELECT url, method, headers, query_params, domain
+        df = _read_frame('''
+            SELECT url, method, headers, query_params AS params, domain
             FROM requests
             WHERE url LIKE '%track%'
                 OR url LIKE '%analytic%'
                 OR url LIKE '%beacon%'
-        ''')
-
-        for row in c.fetchall():
-            request = {
-                'url': row[0],
-                'method': row[1],
-                'headers': json.loads(row[2]),
-                'params': json.loads(row[3]),
-                'domain': row[4]
-            }
-            analysis['tracking_requests'].append(request)
+        ''', conn)
+        df['headers'] = df['headers'].map(_json_loads, na_action='ignore')
+        df['params'] = df['params'].map(_json_loads, na_action='ignore')
+        self._frames['tracking_requests'] = df
+        analysis['tracking_requests'] = df.to_dict(orient='records')
 
         # Analyze beacon usage
         analysis['beacon_usage'] = self._analyze_beacon_requests(c)
@@ -206,8 +372,7 @@ class TrackingAnalysisEngine:
 
     def _analyze_javascript(self) -> Dict[str, Any]:
         """Analyze JavaScript-based tracking"""
-        conn = sqlite3.connect(self.databases['javascript'])
-        c = conn.cursor()
+        conn = self._conn('javascript')
 
         analysis = {
             'fingerprinting_attempts': [],
@@ -215,47 +380,43 @@ class TrackingAnalysisEngine:
             'event_listeners': [],
             'data_access_patterns': []
         }
+        if self._is_empty('javascript', 'js_activities'):
+            return analysis
 
         # Analyze fingerprinting attempts
-        c.execute('''
-            SELECT script_url, function_name, arguments, timestamp
-            FROM js_activities
-            WHERE function_name IN (''' + ','.join(['?']*len(self.tracking_patterns['suspicious_apis'])) + ')',
-            self.tracking_patterns['suspicious_apis']
-        )
-
-        for row in c.fetchall():
-            activity = {
-                'script': row[0],
-                'function': row[1],
-                'args': row[2],
-                'timestamp': row[3]
-            }
-            analysis['fingerprinting_attempts'].append(activity)
+        df = _read_frame(self._javascript_sql, conn,
+                         params=self.tracking_patterns['suspicious_apis'])
+        self._frames['fingerprinting_attempts'] = df
+        analysis['fingerprinting_attempts'] = df.to_dict(orient='records')
 
         return analysis
 
     def _analyze_cross_domain_tracking(self) -> Dict[str, Any]:
         """Analyze cross-domain tracking patterns"""
+        if self._cross_domain_cache is not None:
+            return self._cross_domain_cache
+
         graph = nx.DiGraph()
 
         # Analyze network connections
-        conn = sqlite3.connect(self.databases['network'])
-        c = conn.cursor()
+        c = self._conn('network').cursor()
 
         c.execute('''
-            SELECT domain, url, headers
+            SELECT domain, url
             FROM requests
             WHERE third_party = 1
         ''')
 
-        for row in c.fetchall():
-            source_domain = row[0]
-            target_domain = urlparse(row[1]).netloc
-            headers = json.loads(row[2])
+        edges = set()
+        for rows in iter(lambda: c.fetchmany(4096), []):
+            for row in rows:
+                source_domain = row[0]
+                target_domain = _netloc(row[1])
+
+                if source_domain and target_domain:
+                    edges.add((source_domain, target_domain))
 
-            if source_domain and target_domain:
-                graph.add_edge(source_domain, target_domain)
+        graph.add_edges_from(edges)
 
         # Analyze tracking flow
         analysis = {
@@ -264,8 +425,41 @@ class TrackingAnalysisEngine:
             'tracking_chains': self._identify_tracking_chains(graph)
         }
 
+        self._cross_domain_cache = analysis
         return analysis
 
+    def _identify_central_trackers(self, graph: nx.DiGraph, top_n: int = 10,
+                                   damping: float = 0.85, tol: float = 1e-8,
+                                   max_iter: int = 100) -> List[Dict[str, Any]]:
+        """Rank domains by PageRank over the cross-domain tracking graph.
+
+        Runs power iteration on the graph's CSR adjacency matrix so each step
+        is a sparse matrix-vector product rather than a Python loop over edges.
+        """
+        n = graph.number_of_nodes()
+        if n == 0:
+            return []
+
+        nodes = list(graph)
+        adjacency = nx.to_scipy_sparse_array(graph, nodelist=nodes,
+                                             format='csr', dtype=float)
+        out_degree = np.asarray(adjacency.sum(axis=1)).ravel()
+        dangling = out_degree == 0
+        inv_out_degree = np.divide(1.0, out_degree,
+                                   out=np.zeros(n), where=~dangling)
+        transition = adjacency.T.tocsr()
+
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            previous = rank
+            rank = damping * (transition @ (previous * inv_out_degree))
+            rank += (damping * previous[dangling].sum() + 1.0 - damping) / n
+            if np.abs(rank - previous).sum() < n * tol:
+                break
+
+        top = np.argsort(rank)[::-1][:top_n]
+        return [{'domain': nodes[i], 'score': float(rank[i])} for i in top]
+
     def _detect_fingerprinting(self) -> Dict[str, Any]:
         """Detect various fingerprinting techniques"""
         fingerprinting = {
@@ -274,24 +468,20 @@ class TrackingAnalysisEngine:
             'font_fingerprinting': [],
             'behavioral_fingerprinting': []
         }
+        if self._is_empty('javascript', 'js_activities'):
+            return fingerprinting
 
         # Analyze JavaScript calls
-        conn = sqlite3.connect(self.databases['javascript'])
-        c = conn.cursor()
+        conn = self._conn('javascript')
 
         # Canvas fingerprinting
-        c.execute('''
-            SELECT script_url, timestamp, arguments
+        df = _read_frame('''
+            SELECT script_url AS script, timestamp, arguments AS details
             FROM js_activities
             WHERE function_name IN ('getImageData', 'toDataURL')
-        ''')
-
-        for row in c.fetchall():
-            fingerprinting['canvas_fingerprinting'].append({
-                'script': row[0],
-                'timestamp': row[1],
-                'details': row[2]
-            })
+        ''', conn)
+        self._frames['canvas_fingerprinting'] = df
+        fingerprinting['canvas_fingerprinting'] = df.to_dict(orient='records')
 
         return fingerprinting
 
@@ -322,6 +512,29 @@ class TrackingAnalysisEngine:
         risks['risk_score'] = min(risk_score, 100)  # Cap at 100
         return risks
 
+    def _has_persistent_fingerprinting(self) -> bool:
+        """Check whether fingerprinting APIs were used and their output kept in storage"""
+        if (self._is_empty('javascript', 'js_activities')
+                or self._is_empty('storage', 'local_storage')):
+            return False
+
+        # Let SQLite answer both checks from its indexes instead of
+        # fetching the matching rows
+        called, = self._conn('javascript').execute(
+            self._fingerprint_calls_sql,
+            self.tracking_patterns['suspicious_apis']).fetchone()
+        if not called:
+            return False
+
+        stored, = self._conn('storage').execute('''
+            SELECT EXISTS (
+                SELECT 1 FROM local_storage
+                WHERE key LIKE '%fingerprint%'
+                    OR key LIKE '%canvas%'
+            )
+        ''').fetchone()
+        return bool(stored)
+
     def _generate_recommendations(self) -> List[Dict[str, str]]:
         """Generate privacy recommendations based on analysis"""
         recommendations = []
@@ -344,39 +557,14 @@ class TrackingAnalysisEngine:
         if format == 'html':
             return self._generate_html_report(analysis)
         elif format == 'json':
-            return json.dumps(analysis, indent=2)
+            return _json_dumps(analysis)
         else:
             raise ValueError(f"Unsupported format: {format}")
 
     def _generate_html_report(self, analysis: Dict[str, Any]) -> str:
         """Generate HTML report from analysis results"""
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Web Tracking Analysis Report</title>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; }
-                .section { margin: 20px 0; padding: 10px; border: 1px solid #ccc; }
-                .high-risk { color: #d9534f; }
-                .medium-risk { color: #f0ad4e; }
-                .low-risk { color: #5bc0de; }
-            </style>
-        </head>
-        <body>
-            <h1>Web Tracking Analysis Report</h1>
-            <div class="section">
-                <h2>Summary</h2>
-                <p>Total Trackers: {total_trackers}</p>
-                <p>Risk Score: {risk_score}/100</p>
-            </div>
-            <!-- Add more sections -->
-        </body>
-        </html>
-        """
-
         # Fill in template with analysis data
-        return html_template.format(
+        return _HTML_TEMPLATE.substitute(
             total_trackers=analysis['summary']['total_trackers'],
             risk_score=analysis['privacy_risks']['risk_score']
         )
@@ -412,5 +600,5 @@ class TrackingAnalysisEngine:
         elif format == 'json':
             if filepath:
                 with open(filepath, 'w') as f:
-                    json.dump(analysis, f, indent=2)
+                    f.write(_json_dumps(analysis))
             return analysis
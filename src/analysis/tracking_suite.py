@@ -6,6 +6,7 @@ from cookie_monitor import CookieMonitor
 from storage_monitor import StorageMonitor
 from network_monitor import NetworkMonitor
 from javascript_monitor import JavaScriptMonitor
+from browser_session import SharedBrowserSession
 from tracking_analysis_engine import TrackingAnalysisEngine
 import threading
 import time
@@ -15,6 +16,7 @@ class TrackingResearchSuite:
     def __init__(self, base_port=8000):
         self.base_port = base_port
         self.monitors = {}
+        self.session = None
         self.test_sites = None
         self.analysis_engine = None
 
@@ -25,11 +27,13 @@ class TrackingResearchSuite:
         # Initialize test sites
         self.test_sites = TrackingTestSites(port_start=self.base_port)
 
-        # Initialize monitors
-        self.monitors['cookie'] = CookieMonitor()
-        self.monitors['storage'] = StorageMonitor()
-        self.monitors['network'] = NetworkMonitor()
-        self.monitors['javascript'] = JavaScriptMonitor()
+        # Initialize monitors on one shared browser
+        self.session = SharedBrowserSession()
+        self.monitors['cookie'] = CookieMonitor(session=self.session)
+        self.monitors['storage'] = StorageMonitor(session=self.session)
+        self.monitors['network'] = NetworkMonitor(session=self.session)
+        self.monitors['javascript'] = JavaScriptMonitor(session=self.session)
+        self.session.install_init_scripts()
 
         # Initialize analysis engine
         self.analysis_engine = TrackingAnalysisEngine()
@@ -79,6 +83,10 @@ class TrackingResearchSuite:
         print("Cleaning up resources...")
         for monitor in self.monitors.values():
             monitor.cleanup()
+        if self.session:
+            self.session.cleanup()
+        if self.test_sites:
+            self.test_sites.cleanup()
 
 
 def main():
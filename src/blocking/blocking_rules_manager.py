@@ -1,8 +1,98 @@
 import sqlite3
 import json
+import re
 import argparse
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple
+
+try:
+    import hyperscan
+except ImportError:  # hyperscan is optional; build_matcher falls back to re
+    hyperscan = None
+
+try:
+    import re2
+except ImportError:  # google-re2 is optional; patterns then compile with re
+    re2 = None
+
+
+@lru_cache(maxsize=4096)
+def compile_pattern(pattern):
+    """Compile a rule pattern once, preferring RE2's linear-time DFA matcher"""
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except re2.error:
+            pass  # RE2 rejects backreferences and lookarounds; use re
+    return re.compile(pattern)
+
+
+# Rule types matched against raw response bodies; their matchers take bytes
+BODY_RULE_TYPES = frozenset({'script'})
+
+# Numbered or named backreferences, which break once patterns are fused
+_BACKREF_RE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def _alternation(patterns: List[str], as_bytes: bool = False):
+    """One regex matching wherever any pattern matches, or None if unsafe to fuse"""
+    # Fused patterns share one group numbering, so a backreference would
+    # point at another rule's group and the prefilter could miss a match
+    if any(_BACKREF_RE.search(p) for p in patterns):
+        return None
+    source = '|'.join(f'(?:{p})' for p in patterns)
+    try:
+        return compile_pattern(source.encode('utf-8') if as_bytes else source)
+    except re.error:
+        return None  # e.g. inline global flags or a repeated group name
+
+
+class HyperscanMatcher:
+    """Match every pattern of one rule type in a single Hyperscan pass"""
+
+    def __init__(self, rules: List[Tuple[int, str]], as_bytes: bool = False):
+        # Prefilter mode only promises a superset of the re matches, which
+        # is all callers rely on; text rules also get Unicode classes as re
+        # gives str patterns
+        flags = hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_PREFILTER
+        if not as_bytes:
+            flags |= hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+        self.db = hyperscan.Database()
+        self.db.compile(
+            expressions=[pattern.encode('utf-8') for _, pattern in rules],
+            ids=[rule_id for rule_id, _ in rules],
+            elements=len(rules),
+            flags=[flags] * len(rules)
+        )
+        # A scratch space serves one scan at a time, and the interceptors
+        # run on selenium-wire's worker threads, so each thread clones its
+        # own from a prototype that is never scanned with
+        self._prototype = hyperscan.Scratch(self.db)
+        self._clone_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _scratch(self):
+        """Return the calling thread's scratch space, cloning it on first use"""
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            with self._clone_lock:
+                scratch = self._local.scratch = self._prototype.clone()
+        return scratch
+
+    def search(self, data) -> List[int]:
+        """Return the ids of the rules matching data (empty if none match)"""
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'ignore')
+
+        matched = []
+
+        def on_match(rule_id, start, end, flags, context):
+            matched.append(rule_id)
+
+        self.db.scan(data, match_event_handler=on_match, scratch=self._scratch())
+        return matched
 
 
 class BlockingRulesManager:
@@ -68,32 +158,83 @@ class BlockingRulesManager:
             }
         ]
 
+        self._insert_rules(default_rules)
+
+    def import_rules(self, rules_file: str):
+        """Import rules from JSON file"""
+        with open(rules_file, 'r') as f:
+            rules = json.load(f)
+
+        for rule in rules:
+            compile_pattern(rule['pattern'])  # reject invalid patterns before storing
+
+        self._insert_rules(rules)
+
+    def _insert_rules(self, rules: List[Dict]):
+        """Insert a batch of rules in a single transaction"""
         conn = sqlite3.connect(self.rules_db)
-        c = conn.cursor()
 
-        for rule in default_rules:
-            c.execute('''
+        with conn:
+            conn.executemany('''
                 INSERT INTO blocking_rules
                 (rule_type, pattern, action, description, priority)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (rule['type'], rule['pattern'], rule['action'],
-                  rule['description'], rule['priority']))
+            ''', [(rule['type'], rule['pattern'], rule['action'],
+                   rule['description'], rule.get('priority', 1))
+                  for rule in rules])
 
-        conn.commit()
         conn.close()
 
-    def import_rules(self, rules_file: str):
-        """Import rules from JSON file"""
-        with open(rules_file, 'r') as f:
-            rules = json.load(f)
+    def compile_rules(self) -> Dict[str, re.Pattern]:
+        """Compile the enabled rules into one alternation regex per rule type"""
+        compiled = {}
+        for rule_type, type_rules in self._enabled_rules().items():
+            matcher = _alternation([p for _, p in type_rules],
+                                   as_bytes=rule_type in BODY_RULE_TYPES)
+            if matcher is not None:
+                compiled[rule_type] = matcher
+        return compiled
+
+    def build_matcher(self) -> Dict[str, object]:
+        """Build one multi-pattern prefilter per rule type.
+
+        Uses a Hyperscan database when the library is installed and accepts
+        every pattern of the type; otherwise the fused alternation from
+        compile_rules(). Either way, matcher.search(data) is truthy whenever
+        any rule of that type matches data. Types whose patterns cannot be
+        fused safely are left out, and body rule types take bytes.
+        """
+        if hyperscan is None:
+            return self.compile_rules()
 
+        matchers = {}
+        for rule_type, type_rules in self._enabled_rules().items():
+            as_bytes = rule_type in BODY_RULE_TYPES
+            try:
+                matchers[rule_type] = HyperscanMatcher(type_rules, as_bytes)
+                continue
+            except hyperscan.error:
+                pass  # Hyperscan rejects some constructs; try a fused regex
+            matcher = _alternation([p for _, p in type_rules], as_bytes)
+            if matcher is not None:
+                matchers[rule_type] = matcher
+
+        return matchers
+
+    def _enabled_rules(self) -> Dict[str, List[Tuple[int, str]]]:
+        """(id, pattern) pairs of the enabled rules, by type in priority order"""
         conn = sqlite3.connect(self.rules_db)
         c = conn.cursor()
 
-        for rule in rules:
-            c.execute('''
-                INSERT INTO blocking_rules
-                (rule_type, pattern, action, description, priority)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (rule['type'], rule['pattern'], rule['action'],
-                  rule['description'], rule.get('priority',
+        c.execute('''
+            SELECT id, rule_type, pattern FROM blocking_rules
+            WHERE enabled = 1
+            ORDER BY priority
+        ''')
+
+        rules = {}
+        for rule_id, rule_type, pattern in c.fetchall():
+            rules.setdefault(rule_type, []).append((rule_id, pattern))
+
+        conn.close()
+        return rules
@@ -1,13 +1,152 @@
 import sqlite3
 from datetime import datetime
 import json
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 from typing import Dict, List, Any, Optional
 from seleniumwire import webdriver
 from selenium.webdriver.chrome.options import Options
 import re
 import hashlib
+import bisect
+from functools import lru_cache
+import queue
+import threading
 from pathlib import Path
+from blocking_rules_manager import BlockingRulesManager, BODY_RULE_TYPES, compile_pattern
+
+
+# Request-body markers of scripts collecting fingerprinting attributes,
+# fused into one alternation so a body is scanned once rather than per marker.
+# Compiled as bytes so request bodies are searched without decoding them.
+_FP_COMBINED = re.compile(b'|'.join((
+    rb'canvas\.toDataURL',
+    rb'navigator\.userAgent',
+    rb'navigator\.plugins',
+    rb'navigator\.platform',
+    rb'navigator\.language',
+    rb'screen\.width',
+    rb'screen\.height',
+    rb'window\.innerWidth',
+    rb'window\.innerHeight'
+)))
+
+# Connection tuning for the rules and logs databases: WAL keeps the report
+# readers from blocking interceptor writes and makes commits cheap appends
+_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY'
+)
+
+# Most blocking log rows the writer thread commits in one transaction
+_LOG_FLUSH_SIZE = 256
+
+# Query parameters removed by 'strip_params' modify rules
+TRACKING_PARAMS = frozenset({
+    'utm_source', 'utm_medium', 'utm_campaign',
+    'fbclid', 'gclid', '_ga', 'ref'
+})
+
+# Script rules only inspect the start of a body, and only for these types
+_SCRIPT_SNIFF_BYTES = 65536
+_SCRIPT_CONTENT_TYPES = frozenset({
+    'application/javascript', 'application/x-javascript',
+    'text/javascript', 'text/html'
+})
+
+# Fingerprinting APIs rewritten in scripts matched by 'modify' rules
+_FP_REPLACEMENTS = {
+    b'canvas.toDataURL': b'function() { return ""; }',
+    b'navigator.userAgent': b'"Mozilla/5.0"',
+    b'navigator.plugins': b'[]',
+    b'navigator.vendorSub': b'""'
+}
+_FP_REPLACE_RE = re.compile(b'|'.join(re.escape(k) for k in _FP_REPLACEMENTS))
+
+# Request methods whose bodies are never scanned for fingerprinting
+_BODILESS_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+@lru_cache(maxsize=4096)
+def _netloc(url: str) -> str:
+    """Network location of a URL; tracker URLs repeat, so results are cached"""
+    return urlparse(url).netloc
+
+
+# Page-side protections injected by inject_blocking_scripts
+_BLOCKING_SCRIPT = """\
+(function() {
+    // Protect against fingerprinting
+    const protectFingerprinting = {
+        // Canvas protection
+        protectCanvas: function() {
+            const origGetContext = HTMLCanvasElement.prototype.getContext;
+            HTMLCanvasElement.prototype.getContext = function(type, ...rest) {
+                const context = origGetContext.call(this, type, ...rest);
+                if (type === '2d') {
+                    const origGetImageData = context.getImageData;
+                    context.getImageData = function() {
+                        return origGetImageData.apply(this, [0,0,0,0]);
+                    };
+                }
+                return context;
+            };
+        },
+
+        // Navigator protection
+        protectNavigator: function() {
+            Object.defineProperty(navigator, 'userAgent', {
+                get: function() { return 'Mozilla/5.0'; }
+            });
+            Object.defineProperty(navigator, 'plugins', {
+                get: function() { return []; }
+            });
+        },
+
+        // Storage protection
+        protectStorage: function() {
+            const origSetItem = Storage.prototype.setItem;
+            Storage.prototype.setItem = function(key, value, ...rest) {
+                if (key.match(/(track|fingerprint|analytics)/i)) {
+                    console.log('Blocked storage:', key);
+                    return;
+                }
+                return origSetItem.call(this, key, value, ...rest);
+            };
+        }
+    };
+
+    // Apply protections
+    protectFingerprinting.protectCanvas();
+    protectFingerprinting.protectNavigator();
+    protectFingerprinting.protectStorage();
+
+    // Block known tracking endpoints
+    const originalFetch = window.fetch;
+    window.fetch = function(url, ...rest) {
+        if (url.match(/(analytics|tracking|beacon)/i)) {
+            console.log('Blocked fetch:', url);
+            return Promise.reject('Blocked by tracking protection');
+        }
+        return originalFetch.call(this, url, ...rest);
+    };
+
+    // Block tracking cookies
+    Object.defineProperty(document, 'cookie', {
+        get: function() {
+            return '';
+        },
+        set: function(value) {
+            if (value.match(/(track|analytics|_ga|_gid)/i)) {
+                console.log('Blocked cookie:', value);
+                return '';
+            }
+            return value;
+        }
+    });
+})();
+"""
 
 
 class TrackingBlocker:
@@ -15,6 +154,9 @@ class TrackingBlocker:
         self.rules_db = rules_db
         self.logs_db = logs_db
         self.setup_databases()
+        self._rules_manager = BlockingRulesManager(rules_db)
+        self._open_logs_connection()
+        self._matchers_lock = threading.Lock()
         self.load_rules()
         self.setup_browser()
 
@@ -48,6 +190,9 @@ class TrackingBlocker:
             )
         ''')
 
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
+
         # Logs database
         conn_logs = sqlite3.connect(self.logs_db)
         c_logs = conn_logs.cursor()
@@ -65,11 +210,40 @@ class TrackingBlocker:
             )
         ''')
 
+        # Indexes for the GROUP BY queries in generate_report
+        c_logs.execute('''
+            CREATE INDEX IF NOT EXISTS idx_logs_type
+            ON blocking_logs(request_type)
+        ''')
+        c_logs.execute('''
+            CREATE INDEX IF NOT EXISTS idx_logs_domain
+            ON blocking_logs(domain)
+        ''')
+
+        for pragma in _PRAGMAS:
+            c_logs.execute(pragma)
+
+        # Refresh planner statistics
+        c_logs.execute('ANALYZE')
+
         conn.commit()
         conn.close()
         conn_logs.commit()
         conn_logs.close()
 
+    def _open_logs_connection(self):
+        """Open the long-lived connection used for blocking log writes"""
+        self._logs_conn = sqlite3.connect(self.logs_db, check_same_thread=False,
+                                          isolation_level=None)
+        for pragma in _PRAGMAS:
+            self._logs_conn.execute(pragma)
+        # Interceptors only enqueue rows; a single writer thread owns the
+        # connection so SQLite work stays off the request path
+        self._log_q = queue.SimpleQueue()
+        self._log_writer = threading.Thread(target=self._write_logs,
+                                            daemon=True)
+        self._log_writer.start()
+
     def load_rules(self):
         """Load blocking rules from database"""
         self.rules = {
@@ -86,17 +260,72 @@ class TrackingBlocker:
         c.execute(
             'SELECT * FROM blocking_rules WHERE enabled = 1 ORDER BY priority')
 
+        self._url_rules = []
+        self._script_rules = []
+
         for rule in c.fetchall():
-            rule_dict = {
-                'id': rule[0],
-                'pattern': rule[2],
-                'action': rule[3],
-                'description': rule[4],
-                'priority': rule[5]
-            }
-            self.rules[rule[1]].append(rule_dict)
+            rule_dict = self._build_rule(*rule[:6])
+            if rule_dict:
+                self.rules[rule[1]].append(rule_dict)
+                self._index_rule(rule[1], rule_dict)
 
         conn.close()
+        self._build_matchers()
+
+    def _build_matchers(self):
+        """Build the one-pass prefilters that let clean traffic skip the rule loops"""
+        with self._matchers_lock:
+            self._matchers = self._rules_manager.build_matcher()
+            self._matchers_stale = False
+
+    def _current_matchers(self) -> Dict[str, Any]:
+        """Return the prefilters, rebuilding them first if rules were added since"""
+        # add_rule only marks them stale, so a burst of adds costs one
+        # rebuild; a stale prefilter could hide the new rules' matches
+        if self._matchers_stale:
+            with self._matchers_lock:
+                if self._matchers_stale:
+                    self._matchers = self._rules_manager.build_matcher()
+                    self._matchers_stale = False
+        return self._matchers
+
+    def reload_rules(self):
+        """Rebuild the in-memory rules from the database"""
+        self.load_rules()
+
+    def _build_rule(self, rule_id: int, rule_type: str, pattern: str, action: str,
+                    description: str, priority: int) -> Optional[Dict[str, Any]]:
+        """Compile a rule row into its in-memory form, or None if invalid"""
+        try:
+            # Body rules compile as bytes so they can scan response.body
+            # directly instead of decoding it once per rule
+            source = pattern.encode('utf-8') if rule_type in BODY_RULE_TYPES else pattern
+            pattern_re = compile_pattern(source)
+        except re.error as e:
+            print(f"Skipping rule {rule_id} with invalid pattern: {str(e)}")
+            return None
+
+        return {
+            'id': rule_id,
+            'pattern': pattern,
+            'pattern_re': pattern_re,
+            'action': action,
+            'description': description,
+            'priority': priority
+        }
+
+    def _index_rule(self, rule_type: str, rule: Dict[str, Any]):
+        """Add a rule to the lookup structures used by the interceptors"""
+        # Rules are kept as (bound search, rule) pairs in priority order so
+        # the interceptors skip the per-rule dict and attribute lookups
+        if rule_type == 'url':
+            bisect.insort(self._url_rules,
+                          (rule['pattern_re'].search, rule),
+                          key=lambda entry: entry[1]['priority'])
+        elif rule_type == 'script':
+            bisect.insort(self._script_rules,
+                          (rule['pattern_re'].search, rule),
+                          key=lambda entry: entry[1]['priority'])
 
     def setup_browser(self):
         """Initialize browser with blocking capabilities"""
@@ -133,194 +362,166 @@ class TrackingBlocker:
         conn.commit()
         conn.close()
 
-        # Reload rules
-        self.load_rules()
+        # Compile just the new rule rather than reloading every rule;
+        # keep each list in the same priority order load_rules produces
+        rule_dict = self._build_rule(rule_id, rule_type, pattern, action,
+                                     description, priority)
+        if rule_dict:
+            bisect.insort(self.rules[rule_type], rule_dict,
+                          key=lambda r: r['priority'])
+            self._index_rule(rule_type, rule_dict)
+            self._matchers_stale = True
 
         return rule_id
 
     def _intercept_request(self, request):
         """Intercept and possibly block outgoing requests"""
-        # Check URL rules
-        for rule in self.rules['url']:
-            if re.search(rule['pattern'], request.url):
-                if rule['action'] == 'block':
-                    self._log_blocking(rule['id'], 'block', request.url, 'url')
-                    request.abort()
-                    return
-                elif rule['action'] == 'modify':
-                    self._modify_request(request, rule)
+        # Parse once; the rule checks, modifications and logging share it
+        parsed = urlparse(request.url)
+
+        # Check URL rules in priority order, unless one scan of every URL
+        # pattern finds nothing; a modify rule may rewrite the URL, so
+        # later rules search the current one
+        url_matcher = self._current_matchers().get('url')
+        if url_matcher is None or url_matcher.search(request.url):
+            for search, rule in self._url_rules:
+                if search(request.url):
+                    if self._apply_url_rule(request, rule, parsed):
+                        return
+                    parsed = urlparse(request.url)
 
         # Check for fingerprinting attempts
         if self._detect_fingerprinting(request):
-            self._log_blocking(None, 'block', request.url, 'fingerprint')
+            self._log_blocking(None, 'block', request.url, 'fingerprint',
+                               netloc=parsed.netloc)
             request.abort()
             return
 
+    def _apply_url_rule(self, request, rule: Dict[str, Any], parsed) -> bool:
+        """Apply a matched URL rule, returning True if the request was blocked"""
+        if rule['action'] == 'block':
+            self._log_blocking(rule['id'], 'block', request.url, 'url',
+                               netloc=parsed.netloc)
+            request.abort()
+            return True
+        elif rule['action'] == 'modify':
+            self._modify_request(request, rule, parsed)
+        return False
+
     def _intercept_response(self, request, response):
         """Intercept and modify responses"""
         if response:
-            # Check for tracking scripts
-            for rule in self.rules['script']:
-                if re.search(rule['pattern'], response.body.decode('utf-8', 'ignore')):
+            content_type = response.headers.get('Content-Type', '')
+            if content_type.split(';')[0].strip().lower() not in _SCRIPT_CONTENT_TYPES:
+                return
+
+            # Check for tracking scripts in the head of the body; images,
+            # fonts and large bundles are not scanned end to end
+            head = response.body[:_SCRIPT_SNIFF_BYTES]
+            script_matcher = self._current_matchers().get('script')
+            if script_matcher is not None and not script_matcher.search(head):
+                return
+            for search, rule in self._script_rules:
+                if search(head):
+                    self._log_blocking(
+                        rule['id'], rule['action'], request.url, 'script')
+
                     if rule['action'] == 'block':
                         response.body = b''  # Empty response
+                        return
                     elif rule['action'] == 'modify':
                         response.body = self._modify_script(
                             response.body, rule)
+                        head = response.body[:_SCRIPT_SNIFF_BYTES]
 
-                    self._log_blocking(
-                        rule['id'], rule['action'], request.url, 'script')
-
-    def _modify_request(self, request, rule: Dict[str, Any]):
+    def _modify_request(self, request, rule: Dict[str, Any], url_parts=None):
         """Modify request according to rule"""
         # Strip tracking parameters
         if 'strip_params' in rule['pattern']:
-            url_parts = list(urlparse(request.url))
-            query = parse_qs(url_parts[4], keep_blank_values=True)
+            if url_parts is None:
+                url_parts = urlparse(request.url)
+            # Remove tracking parameters, keeping repeated and blank ones
+            pairs = [(k, v) for k, v in parse_qsl(url_parts.query, keep_blank_values=True)
+                     if k not in TRACKING_PARAMS]
 
-            # Remove tracking parameters
-            tracking_params = [
-                'utm_source', 'utm_medium', 'utm_campaign',
-                'fbclid', 'gclid', '_ga', 'ref'
-            ]
-
-            for param in tracking_params:
-                query.pop(param, None)
-
-            url_parts[4] = '&'.join(f"{k}={v[0]}" for k, v in query.items())
-            request.url = urlparse.urlunparse(url_parts)
+            request.url = urlunparse(url_parts._replace(query=urlencode(pairs)))
 
     def _modify_script(self, script_body: bytes, rule: Dict[str, Any]) -> bytes:
         """Modify script content according to rule"""
-        script_text = script_body.decode('utf-8', 'ignore')
-
-        # Replace fingerprinting functions
+        # Replace fingerprinting functions in a single pass over the bytes
         if 'fingerprint' in rule['pattern']:
-            replacements = {
-                'canvas.toDataURL': 'function() { return ""; }',
-                'navigator.userAgent': '"Mozilla/5.0"',
-                'navigator.plugins': '[]',
-                'navigator.vendorSub': '""'
-            }
-
-            for old, new in replacements.items():
-                script_text = script_text.replace(old, new)
-
-        return script_text.encode('utf-8')
+            return _FP_REPLACE_RE.sub(
+                lambda m: _FP_REPLACEMENTS[m.group(0)], script_body)
+        return script_body
 
     def _detect_fingerprinting(self, request) -> bool:
         """Detect potential fingerprinting attempts"""
-        fingerprinting_patterns = [
-            r'canvas\.toDataURL',
-            r'navigator\.userAgent',
-            r'navigator\.plugins',
-            r'navigator\.platform',
-            r'navigator\.language',
-            r'screen\.width',
-            r'screen\.height',
-            r'window\.innerWidth',
-            r'window\.innerHeight'
-        ]
-
-        request_body = request.body or b''
-        request_text = request_body.decode('utf-8', 'ignore')
-
-        return any(re.search(pattern, request_text) for pattern in fingerprinting_patterns)
+        # Bodiless methods and empty bodies have nothing to scan
+        if request.method in _BODILESS_METHODS or not request.body:
+            return False
+        return _FP_COMBINED.search(request.body) is not None
 
     def _log_blocking(self, rule_id: Optional[int], action: str,
-                      url: str, request_type: str):
+                      url: str, request_type: str, netloc: Optional[str] = None):
         """Log blocking actions"""
-        conn = sqlite3.connect(self.logs_db)
-        c = conn.cursor()
-
-        c.execute('''
-            INSERT INTO blocking_logs
-            (rule_id, action, request_url, request_type, domain)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (rule_id, action, url, request_type, urlparse(url).netloc))
-
-        conn.commit()
-        conn.close()
+        # A missing netloc is filled in by the writer thread
+        self._log_q.put((rule_id, action, url, request_type, netloc))
+
+    def _write_logs(self):
+        """Drain queued log rows into the database in batches"""
+        get_nowait = self._log_q.get_nowait
+        while True:
+            batch = [self._log_q.get()]
+            while len(batch) < _LOG_FLUSH_SIZE:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
+
+            # None stops the writer; Events are flush markers
+            rows = [item if item[4] is not None else item[:4] + (_netloc(item[2]),)
+                    for item in batch if isinstance(item, tuple)]
+            if rows:
+                try:
+                    self._insert_logs(rows)
+                except sqlite3.Error as e:
+                    print(f"Error writing blocking logs: {str(e)}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+    def _insert_logs(self, rows: List[tuple]):
+        """Write a batch of blocking log rows in one transaction"""
+        self._logs_conn.execute('BEGIN')
+        try:
+            self._logs_conn.executemany('''
+                INSERT INTO blocking_logs
+                (rule_id, action, request_url, request_type, domain)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+        except sqlite3.Error:
+            self._logs_conn.execute('ROLLBACK')
+            raise
+        self._logs_conn.execute('COMMIT')
+
+    def flush_logs(self):
+        """Block until every log row queued so far has been written"""
+        if not self._log_writer.is_alive():
+            return
+        done = threading.Event()
+        self._log_q.put(done)
+        done.wait()
 
     def inject_blocking_scripts(self):
         """Inject blocking scripts into the page"""
-        blocking_script = """
-        (function() {
-            // Protect against fingerprinting
-            const protectFingerprinting = {
-                // Canvas protection
-                protectCanvas: function() {
-                    const origGetContext = HTMLCanvasElement.prototype.getContext;
-                    HTMLCanvasElement.prototype.getContext = function(type) {
-                        const context = origGetContext.apply(this, arguments);
-                        if (type === '2d') {
-                            const origGetImageData = context.getImageData;
-                            context.getImageData = function() {
-                                return origGetImageData.apply(this, [0,0,0,0]);
-                            };
-                        }
-                        return context;
-                    };
-                },
-
-                // Navigator protection
-                protectNavigator: function() {
-                    Object.defineProperty(navigator, 'userAgent', {
-                        get: function() { return 'Mozilla/5.0'; }
-                    });
-                    Object.defineProperty(navigator, 'plugins', {
-                        get: function() { return []; }
-                    });
-                },
-
-                // Storage protection
-                protectStorage: function() {
-                    const origSetItem = Storage.prototype.setItem;
-                    Storage.prototype.setItem = function(key, value) {
-                        if (key.match(/(track|fingerprint|analytics)/i)) {
-                            console.log('Blocked storage:', key);
-                            return;
-                        }
-                        return origSetItem.apply(this, arguments);
-                    };
-                }
-            };
-
-            // Apply protections
-            protectFingerprinting.protectCanvas();
-            protectFingerprinting.protectNavigator();
-            protectFingerprinting.protectStorage();
-
-            // Block known tracking endpoints
-            const originalFetch = window.fetch;
-            window.fetch = function(url, options) {
-                if (url.match(/(analytics|tracking|beacon)/i)) {
-                    console.log('Blocked fetch:', url);
-                    return Promise.reject('Blocked by tracking protection');
-                }
-                return originalFetch.apply(this, arguments);
-            };
-
-            // Block tracking cookies
-            Object.defineProperty(document, 'cookie', {
-                get: function() {
-                    return '';
-                },
-                set: function(value) {
-                    if (value.match(/(track|analytics|_ga|_gid)/i)) {
-                        console.log('Blocked cookie:', value);
-                        return '';
-                    }
-                    return value;
-                }
-            });
-        })();
-        """
-
-        self.driver.execute_script(blocking_script)
+        self.driver.execute_script(_BLOCKING_SCRIPT)
 
     def generate_report(self) -> Dict[str, Any]:
         """Generate blocking report"""
+        self.flush_logs()
+
         conn = sqlite3.connect(self.logs_db)
         c = conn.cursor()
 
@@ -329,11 +530,23 @@ class TrackingBlocker:
             'blocks_by_type': {},
             'top_blocked_domains': [],
             'blocking_rules': {
-                'active': len([r for rt in self.rules.values() for r in rt]),
-                'by_type': {rt: len(rules) for rt, rules in self.rules.items()}
+                'active': 0,
+                'by_type': {}
             }
         }
 
+        # Count active rules from the rules database
+        rules_conn = sqlite3.connect(self.rules_db)
+        rules_by_type = dict(rules_conn.execute('''
+            SELECT rule_type, COUNT(*) FROM blocking_rules
+            WHERE enabled = 1
+            GROUP BY rule_type
+        ''').fetchall())
+        rules_conn.close()
+        report['blocking_rules']['by_type'] = {
+            rt: rules_by_type.get(rt, 0) for rt in self.rules}
+        report['blocking_rules']['active'] = sum(rules_by_type.values())
+
         # Get blocking statistics
         c.execute('''
             SELECT request_type, COUNT(*) as count
@@ -353,7 +566,8 @@ class TrackingBlocker:
         report['top_blocked_domains'] = c.fetchall()
 
         # Calculate total blocks
-        report['total_blocks'] = sum(report['blocks_by_type'].values())
+        c.execute('SELECT COUNT(*) FROM blocking_logs')
+        report['total_blocks'] = c.fetchone()[0]
 
         conn.close()
         return report
@@ -362,3 +576,6 @@ class TrackingBlocker:
         """Clean up resources"""
         if self.driver:
             self.driver.quit()
+        self._log_q.put(None)
+        self._log_writer.join()
+        self._logs_conn.close()
@@ -1,9 +1,23 @@
 from typing import Dict, List, Any
+import csv
 import json
-import pandas as pd
 from datetime import datetime
 import logging
 from pathlib import Path
+from cookie_monitor import CookieMonitor
+from storage_monitor import StorageMonitor
+from network_monitor import NetworkMonitor
+from javascript_monitor import JavaScriptMonitor
+from browser_session import SharedBrowserSession
+
+# Each monitor registers its own hooks and database, so only the ones an
+# experiment asks for are constructed
+MONITOR_FACTORIES = {
+    'cookie': CookieMonitor,
+    'storage': StorageMonitor,
+    'network': NetworkMonitor,
+    'javascript': JavaScriptMonitor
+}
 
 
 class ExperimentRunner:
@@ -32,17 +46,19 @@ class ExperimentRunner:
             'metrics': {}
         }
 
+        monitors = {}
+        session = None
+        test_sites = None
         try:
             # Initialize components
             test_sites = TrackingTestSites(
                 port_start=config.get('base_port', 8000))
             blocker = TrackingBlocker()
-            monitors = {
-                'cookie': CookieMonitor(),
-                'storage': StorageMonitor(),
-                'network': NetworkMonitor(),
-                'javascript': JavaScriptMonitor()
-            }
+            # The selected monitors share one browser
+            session = SharedBrowserSession()
+            for name in config.get('monitors', list(MONITOR_FACTORIES)):
+                monitors[name] = MONITOR_FACTORIES[name](session=session)
+            session.install_init_scripts()
             analyzer = TrackingAnalysisEngine()
 
             # Run test websites
@@ -80,8 +96,12 @@ class ExperimentRunner:
             # Cleanup
             for monitor in monitors.values():
                 monitor.cleanup()
+            if session:
+                session.cleanup()
             if config.get('blocking_enabled'):
                 blocker.cleanup()
+            if test_sites:
+                test_sites.cleanup()
 
         return results
 
@@ -120,12 +140,24 @@ class ExperimentRunner:
             json.dump(results, f, indent=2)
 
         # Generate CSV reports
-        metrics_df = pd.DataFrame(results['metrics'])
-        metrics_df.to_csv(experiment_dir / 'metrics.csv')
+        with open(experiment_dir / 'metrics.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['metric', 'value'])
+            writer.writerows(self._flatten_metrics(results['metrics']))
 
         # Generate summary report
         self._generate_summary_report(results, experiment_dir)
 
+    def _flatten_metrics(self, metrics: Any, prefix: str = '') -> List[tuple]:
+        """Flatten nested metrics into (dotted key, value) rows"""
+        if isinstance(metrics, dict):
+            rows = []
+            for key, value in metrics.items():
+                name = f"{prefix}.{key}" if prefix else str(key)
+                rows.extend(self._flatten_metrics(value, name))
+            return rows
+        return [(prefix, metrics)]
+
     def _generate_summary_report(self, results: Dict[str, Any], output_dir: Path):
         """Generate a human-readable summary report"""
         summary = []
@@ -0,0 +1,67 @@
+from seleniumwire import webdriver
+from selenium.webdriver.chrome.options import Options
+
+
+def _minify_js(source):
+    """Drop indentation, blank lines and whole-line comments from a script"""
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def register_init_script(driver, source):
+    """Run a script in every new document before any of the page's own scripts"""
+    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument',
+                           {'source': _minify_js(source)})
+
+
+class SharedBrowserSession:
+    """One headless Chrome shared by several monitors"""
+
+    def __init__(self):
+        self._req_cbs = []
+        self._resp_cbs = []
+        self._init_scripts = []
+        self.setup_browser()
+
+    def setup_browser(self):
+        """Initialize browser whose interceptors fan out to registered monitors"""
+        chrome_options = Options()
+        chrome_options.add_argument('--headless')
+        self.driver = webdriver.Chrome(options=chrome_options)
+        self.driver.request_interceptor = self._intercept_request
+        self.driver.response_interceptor = self._intercept_response
+
+    def add_request_interceptor(self, callback):
+        """Register a callback for every outgoing request"""
+        self._req_cbs.append(callback)
+
+    def add_response_interceptor(self, callback):
+        """Register a callback for every response"""
+        self._resp_cbs.append(callback)
+
+    def add_init_script(self, source):
+        """Queue a monitor's hook script for install_init_scripts"""
+        self._init_scripts.append(source)
+
+    def install_init_scripts(self):
+        """Register each queued hook script once for the whole session"""
+        # Kept as separate scripts so a throw or syntax error in one
+        # monitor's hooks cannot stop the others from installing
+        for source in self._init_scripts:
+            register_init_script(self.driver, source)
+        self._init_scripts = []
+
+    def _intercept_request(self, request):
+        """Pass an outgoing request to each registered monitor"""
+        for callback in self._req_cbs:
+            callback(request)
+
+    def _intercept_response(self, request, response):
+        """Pass a response to each registered monitor"""
+        for callback in self._resp_cbs:
+            callback(request, response)
+
+    def cleanup(self):
+        """Clean up resources"""
+        if self.driver:
+            self.driver.quit()
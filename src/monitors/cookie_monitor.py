@@ -1,17 +1,64 @@
 import sqlite3
-from datetime import datetime
 import json
+import time
+import threading
 from urllib.parse import urlparse
 from seleniumwire import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from browser_session import register_init_script
+
+
+# WAL and a relaxed sync level make each cookie insert a cheap append
+_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY'
+)
+
+# Bumped when stored data changes format; kept in PRAGMA user_version
+_SCHEMA_VERSION = 1
+
+
+# document.cookie hooks, registered to run before any page script
+_COOKIE_HOOK_SCRIPT = """
+(function() {
+    let originalSetter = Object.getOwnPropertyDescriptor(Document.prototype, 'cookie').set;
+    let originalGetter = Object.getOwnPropertyDescriptor(Document.prototype, 'cookie').get;
+
+    Object.defineProperty(document, 'cookie', {
+        set: function(val) {
+            window.dispatchEvent(new CustomEvent('cookieChanged', {
+                detail: { value: val, type: 'set' }
+            }));
+            return originalSetter.call(document, val);
+        },
+        get: function() {
+            let value = originalGetter.call(document);
+            window.dispatchEvent(new CustomEvent('cookieRead', {
+                detail: { value: value, type: 'get' }
+            }));
+            return value;
+        }
+    });
+})();
+"""
 
 
 class CookieMonitor:
-    def __init__(self, db_path="cookie_monitor.db"):
+    def __init__(self, db_path="cookie_monitor.db", session=None):
         self.db_path = db_path
+        # A SharedBrowserSession lets several monitors drive one browser
+        self.session = session
         self.setup_database()
-        self.setup_browser()
+        self._open_connection()
+        if session is not None:
+            self.driver = session.driver
+        else:
+            self.setup_browser()
+        self._register_hooks()
 
     def setup_database(self):
         """Initialize SQLite database for cookie tracking"""
@@ -29,15 +76,51 @@ class CookieMonitor:
                 http_only INTEGER,
                 same_site TEXT,
                 source_url TEXT,
-                creation_time TIMESTAMP,
+                creation_time INTEGER,
                 last_accessed TIMESTAMP,
                 is_session INTEGER,
                 is_deleted INTEGER DEFAULT 0
             )
         ''')
+
+        # Databases from before integer nanosecond timestamps hold the local
+        # ISO text of sqlite3's datetime adapter, which sorts above every
+        # integer; convert those rows once
+        version, = c.execute('PRAGMA user_version').fetchone()
+        if version < _SCHEMA_VERSION:
+            c.execute('''
+                UPDATE cookies
+                SET creation_time = CAST(ROUND(
+                    (julianday(creation_time, 'utc') - 2440587.5) * 86400000
+                ) AS INTEGER) * 1000000
+                WHERE typeof(creation_time) = 'text'
+            ''')
+            c.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+            conn.commit()
+
+        # One index per detect_respawning lookup, each with the filtered
+        # columns ahead of creation_time so both end in a seek
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cookies_name_deleted
+            ON cookies(name, is_deleted, creation_time)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_cookies_name_created
+            ON cookies(name, creation_time)
+        ''')
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
         conn.commit()
         conn.close()
 
+    def _open_connection(self):
+        """Open the long-lived connection used for cookie writes"""
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                     isolation_level=None)
+        for pragma in _PRAGMAS:
+            self._conn.execute(pragma)
+        self._lock = threading.Lock()
+
     def setup_browser(self):
         """Initialize Selenium WebDriver with wire for request interception"""
         chrome_options = Options()
@@ -49,7 +132,6 @@ class CookieMonitor:
         try:
             self.driver.get(url)
             self._capture_initial_cookies()
-            self._setup_cookie_listeners()
         except Exception as e:
             print(f"Error monitoring URL {url}: {str(e)}")
 
@@ -59,82 +141,62 @@ class CookieMonitor:
         for cookie in cookies:
             self._store_cookie(cookie)
 
-    def _setup_cookie_listeners(self):
-        """Setup JavaScript listeners for cookie changes"""
-        js_code = """
-        (function() {
-            let originalSetter = Object.getOwnPropertyDescriptor(Document.prototype, 'cookie').set;
-            let originalGetter = Object.getOwnPropertyDescriptor(Document.prototype, 'cookie').get;
-
-            Object.defineProperty(document, 'cookie', {
-                set: function(val) {
-                    window.dispatchEvent(new CustomEvent('cookieChanged', {
-                        detail: { value: val, type: 'set' }
-                    }));
-                    return originalSetter.call(document, val);
-                },
-                get: function() {
-                    let value = originalGetter.call(document);
-                    window.dispatchEvent(new CustomEvent('cookieRead', {
-                        detail: { value: value, type: 'get' }
-                    }));
-                    return value;
-                }
-            });
-        })();
-        """
-        self.driver.execute_script(js_code)
+    def _register_hooks(self):
+        """Have the hook script run before any page script on every navigation"""
+        if self.session is not None:
+            self.session.add_init_script(_COOKIE_HOOK_SCRIPT)
+        else:
+            register_init_script(self.driver, _COOKIE_HOOK_SCRIPT)
 
     def _store_cookie(self, cookie_data):
         """Store cookie data in SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
-        c.execute('''
-            INSERT INTO cookies (
-                domain, name, value, path, expires, secure,
-                http_only, source_url, creation_time, is_session
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            cookie_data.get('domain'),
-            cookie_data.get('name'),
-            cookie_data.get('value'),
-            cookie_data.get('path'),
-            cookie_data.get('expiry'),
-            cookie_data.get('secure', False),
-            cookie_data.get('httpOnly', False),
-            self.driver.current_url,
-            datetime.now(),
-            cookie_data.get('expiry') is None
-        ))
-
-        conn.commit()
-        conn.close()
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO cookies (
+                    domain, name, value, path, expires, secure,
+                    http_only, source_url, creation_time, is_session
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                cookie_data.get('domain'),
+                cookie_data.get('name'),
+                cookie_data.get('value'),
+                cookie_data.get('path'),
+                cookie_data.get('expiry'),
+                cookie_data.get('secure', False),
+                cookie_data.get('httpOnly', False),
+                self.driver.current_url,
+                time.time_ns(),
+                cookie_data.get('expiry') is None
+            ))
 
     def detect_respawning(self, cookie_name):
         """Detect if a cookie is being respawned after deletion"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        with self._lock:
+            c = self._conn.cursor()
 
-        c.execute('''
-            SELECT COUNT(*) FROM cookies
-            WHERE name = ? AND is_deleted = 1
-            AND creation_time > (
-                SELECT creation_time FROM cookies
+            # The earliest deletion is a seek to the first entry of
+            # (name, 1) in idx_cookies_name_deleted
+            c.execute('''
+                SELECT MIN(creation_time) FROM cookies
                 WHERE name = ? AND is_deleted = 1
-                ORDER BY creation_time DESC LIMIT 1
-            )
-        ''', (cookie_name, cookie_name))
-
-        respawn_count = c.fetchone()[0]
-        conn.close()
-        return respawn_count > 0
+            ''', (cookie_name,))
+            first_deleted = c.fetchone()[0]
+
+            respawned = False
+            if first_deleted is not None:
+                # Any later instance of the cookie means it came back; a
+                # range seek on idx_cookies_name_created
+                c.execute('''
+                    SELECT 1 FROM cookies
+                    WHERE name = ? AND creation_time > ?
+                    LIMIT 1
+                ''', (cookie_name, first_deleted))
+                respawned = c.fetchone() is not None
+
+        return respawned
 
     def generate_report(self):
         """Generate a report of cookie activity"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
         report = {
             'total_cookies': 0,
             'respawned_cookies': 0,
@@ -143,15 +205,18 @@ class CookieMonitor:
             'session_cookies': 0
         }
 
-        c.execute('SELECT COUNT(*) FROM cookies')
-        report['total_cookies'] = c.fetchone()[0]
+        with self._lock:
+            c = self._conn.cursor()
+            c.execute('SELECT COUNT(*) FROM cookies')
+            report['total_cookies'] = c.fetchone()[0]
 
-        # Add more detailed reporting queries here
+            # Add more detailed reporting queries here
 
-        conn.close()
         return report
 
     def cleanup(self):
         """Clean up resources"""
-        if self.driver:
+        # A shared browser is quit by its session
+        if self.driver and self.session is None:
             self.driver.quit()
+        self._conn.close()
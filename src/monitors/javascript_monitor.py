@@ -1,15 +1,201 @@
 import sqlite3
-from datetime import datetime
 import json
+import queue
+import threading
 from seleniumwire import webdriver
 from selenium.webdriver.chrome.options import Options
+from browser_session import register_init_script
 
 
+# WAL lets report queries read while the interceptor writes, and a relaxed
+# sync level makes each commit a cheap append
+_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA busy_timeout=5000'
+)
+
+
+# CDP binding the injected hooks report through; its calls arrive as
+# Runtime.bindingCalled events on selenium's DevTools connection
+_BINDING_NAME = 'tsPush'
+
+# Most queued binding payloads the writer thread commits in one transaction
+_WRITE_BATCH_SIZE = 64
+
+# Event codes written by the hooks, indexed by the code each one records, and
+# the ones stored with is_suspicious set. Bare API names, as the analysis
+# engine filters function_name on them.
+_EVENT_NAMES = (
+    'getItem',
+    'setItem',
+    'open',
+    'send',
+    'fetch',
+    'getImageData'
+)
+_SUSPICIOUS_EVENTS = frozenset({'getImageData'})
+
+# Documents whose interned strings are kept while waiting for their final
+# flush; the oldest are dropped past this in case a pagehide never arrives
+_MAX_TRACKED_DOCUMENTS = 256
+
+# Fraction of hooked calls that capture a JavaScript stack trace
+_STACK_SAMPLE_RATE = 0.01
+
+# Ints per hooked call in the page-side log: event code, calling script URL
+# index, key/URL index, ms since timeOrigin, stack index (-1 when absent)
+_RECORD_SIZE = 5
+
+# Hooks for Storage, XHR, fetch and canvas API usage; registered to run before
+# any page script. Calls are appended to a typed-array log with interned
+# strings and flushed through the CDP binding every 100 ms and on pagehide.
+_MONITORING_SCRIPT = """
+(function() {
+    const buf = new Int32Array(65535);
+    let head = 0;
+    const strTab = new Map();
+    let newStrings = [];
+    const doc = Math.random().toString(36).slice(2);
+
+    function intern(value) {
+        if (value === undefined || value === null) {
+            return -1;
+        }
+        value = String(value);
+        let index = strTab.get(value);
+        if (index === undefined) {
+            index = strTab.size;
+            strTab.set(value, index);
+            newStrings.push(value);
+        }
+        return index;
+    }
+
+    // end marks the document's last flush so its strings can be released
+    function flush(end) {
+        if ((head === 0 && !end) || !window.tsPush) {
+            return;
+        }
+        window.tsPush(JSON.stringify({
+            doc: doc,
+            origin: performance.timeOrigin,
+            strings: newStrings,
+            records: Array.from(buf.subarray(0, head)),
+            end: end === true
+        }));
+        head = 0;
+        newStrings = [];
+    }
+
+    // The hooks run without a script URL, so the first URL in a stack is
+    // the caller's; without a stack, the running classic script if any,
+    // else the page itself (inline code, timers, event handlers)
+    function callerScript(stack) {
+        const frame = stack && /(https?:\/\/[^\s()]+?):\d+:\d+/.exec(stack);
+        if (frame) {
+            return frame[1];
+        }
+        const script = document.currentScript;
+        return (script && script.src) || location.href;
+    }
+
+    // Codes index _EVENT_NAMES on the Python side
+    function record(code, key) {
+        if (head + 5 > buf.length) {
+            flush();
+        }
+        // Stacks are expensive to build, so only a sample is captured
+        const stack = (window.__tsStackSample && Math.random() < window.__tsStackSample)
+            ? new Error().stack : null;
+        buf[head++] = code;
+        buf[head++] = intern(callerScript(stack));
+        buf[head++] = intern(key);
+        buf[head++] = Math.round(performance.now());
+        buf[head++] = intern(stack);
+    }
+
+    setInterval(flush, 100);
+    // A page kept in the back-forward cache may come back and log more
+    window.addEventListener('pagehide', function(event) {
+        flush(!event.persisted);
+    });
+
+    // Monitor DOM Storage Access
+    const storageHandler = {
+        get: function(target, prop) {
+            record(0, prop);
+            return target[prop];
+        },
+        set: function(target, prop, value) {
+            record(1, prop);
+            target[prop] = value;
+            return true;
+        }
+    };
+
+    // Proxy localStorage and sessionStorage
+    window.localStorage = new Proxy(window.localStorage, storageHandler);
+    window.sessionStorage = new Proxy(window.sessionStorage, storageHandler);
+
+    // Monitor XMLHttpRequest
+    const originalXHR = window.XMLHttpRequest;
+    window.XMLHttpRequest = function() {
+        const xhr = new originalXHR();
+        const original = {
+            open: xhr.open,
+            send: xhr.send
+        };
+
+        xhr.open = function(...args) {
+            record(2, args[1]);
+            return original.open.apply(xhr, args);
+        };
+
+        xhr.send = function(...args) {
+            record(3, null);
+            return original.send.apply(xhr, args);
+        };
+
+        return xhr;
+    };
+
+    // Monitor Fetch API
+    const originalFetch = window.fetch;
+    window.fetch = function(...args) {
+        const resource = args[0];
+        record(4, resource && resource.url ? resource.url : resource);
+        return originalFetch.apply(this, args);
+    };
+
+    // Monitor Canvas API for fingerprinting
+    const originalGetImageData = CanvasRenderingContext2D.prototype.getImageData;
+    CanvasRenderingContext2D.prototype.getImageData = function(...args) {
+        record(5, null);
+        return originalGetImageData.apply(this, args);
+    };
+})();
+"""
+
 class JavaScriptMonitor:
-    def __init__(self, db_path="javascript_monitor.db"):
+    def __init__(self, db_path="javascript_monitor.db", session=None,
+                 stack_sample_rate=_STACK_SAMPLE_RATE):
         self.db_path = db_path
+        self.stack_sample_rate = stack_sample_rate
+        # A SharedBrowserSession lets several monitors drive one browser
+        self.session = session
         self.setup_database()
-        self.setup_browser()
+        self._open_connection()
+        if session is not None:
+            self.driver = session.driver
+        else:
+            self.setup_browser()
+        # The writer must be running before the binding can deliver events
+        self._start_event_collection()
+        self._register_hooks()
 
     def setup_database(self):
         """Initialize database for JavaScript activity tracking"""
@@ -19,7 +205,7 @@ class JavaScriptMonitor:
         c.execute('''
             CREATE TABLE IF NOT EXISTS js_activities (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TIMESTAMP,
+                timestamp INTEGER,
                 script_url TEXT,
                 function_name TEXT,
                 arguments TEXT,
@@ -41,154 +227,174 @@ class JavaScriptMonitor:
             )
         ''')
 
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
         conn.commit()
         conn.close()
 
+    def _open_connection(self):
+        """Open the long-lived connection used for activity writes and queries"""
+        # Autocommit mode; batch writes open their own BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                     isolation_level=None, cached_statements=256)
+        for pragma in _PRAGMAS:
+            self._conn.execute(pragma)
+        self._lock = threading.Lock()
+
+    def _query(self, query):
+        """Run a read query on the shared, tuned connection and return its rows"""
+        with self._lock:
+            return self._conn.execute(query).fetchall()
+
     def setup_browser(self):
         """Initialize browser with JavaScript monitoring capabilities"""
         chrome_options = Options()
         chrome_options.add_argument('--headless')
         self.driver = webdriver.Chrome(options=chrome_options)
 
-    def inject_monitoring_code(self):
-        """Inject JavaScript code to monitor API usage"""
-        monitoring_code = """
-        (function() {
-            // Monitor DOM Storage Access
-            const storageHandler = {
-                get: function(target, prop) {
-                    window.dispatchEvent(new CustomEvent('storageAccess', {
-                        detail: {
-                            type: 'get',
-                            storage: target.constructor.name,
-                            key: prop,
-                            stack: new Error().stack
-                        }
-                    }));
-                    return target[prop];
-                },
-                set: function(target, prop, value) {
-                    window.dispatchEvent(new CustomEvent('storageAccess', {
-                        detail: {
-                            type: 'set',
-                            storage: target.constructor.name,
-                            key: prop,
-                            value: value,
-                            stack: new Error().stack
-                        }
-                    }));
-                    target[prop] = value;
-                    return true;
-                }
-            };
-
-            // Proxy localStorage and sessionStorage
-            window.localStorage = new Proxy(window.localStorage, storageHandler);
-            window.sessionStorage = new Proxy(window.sessionStorage, storageHandler);
-
-            // Monitor XMLHttpRequest
-            const originalXHR = window.XMLHttpRequest;
-            window.XMLHttpRequest = function() {
-                const xhr = new originalXHR();
-                const original = {
-                    open: xhr.open,
-                    send: xhr.send
-                };
-
-                xhr.open = function() {
-                    window.dispatchEvent(new CustomEvent('xhrCall', {
-                        detail: {
-                            type: 'open',
-                            arguments: arguments,
-                            stack: new Error().stack
-                        }
-                    }));
-                    return original.open.apply(xhr, arguments);
-                };
-
-                xhr.send = function() {
-                    window.dispatchEvent(new CustomEvent('xhrCall', {
-                        detail: {
-                            type: 'send',
-                            arguments: arguments,
-                            stack: new Error().stack
-                        }
-                    }));
-                    return original.send.apply(xhr, arguments);
-                };
-
-                return xhr;
-            };
-
-            // Monitor Fetch API
-            const originalFetch = window.fetch;
-            window.fetch = function() {
-                window.dispatchEvent(new CustomEvent('fetchCall', {
-                    detail: {
-                        arguments: arguments,
-                        stack: new Error().stack
-                    }
-                }));
-                return originalFetch.apply(this, arguments);
-            };
-
-            // Monitor Canvas API for fingerprinting
-            const originalGetImageData = CanvasRenderingContext2D.prototype.getImageData;
-            CanvasRenderingContext2D.prototype.getImageData = function() {
-                window.dispatchEvent(new CustomEvent('canvasCall', {
-                    detail: {
-                        method: 'getImageData',
-                        arguments: arguments,
-                        stack: new Error().stack
-                    }
-                }));
-                return originalGetImageData.apply(this, arguments);
-            };
-        })();
-        """
-        self.driver.execute_script(monitoring_code)
+    def _register_hooks(self):
+        """Have the hook script run before any page script on every navigation"""
+        # Binding calls are only reported to the CDP session that added the
+        # binding, so it is added on the DevTools connection we listen on;
+        # it survives navigations, so once is enough
+        devtools, self._devtools = self.driver.start_devtools()
+        self._binding_event = devtools.runtime.BindingCalled
+        self._binding_callback = self._devtools.add_callback(
+            self._binding_event, self._on_binding_called)
+        self._devtools.execute(devtools.runtime.add_binding(name=_BINDING_NAME))
+        script = (f"window.__tsStackSample = {float(self.stack_sample_rate)};\n"
+                  + _MONITORING_SCRIPT)
+        if self.session is not None:
+            self.session.add_init_script(script)
+        else:
+            register_init_script(self.driver, script)
+
+    def _start_event_collection(self):
+        """Start the thread that stores events reported by the hooks"""
+        # Binding callbacks only enqueue payloads; decoding and SQLite
+        # writes happen on a single writer thread
+        self._strings = {}
+        self._q = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_events, daemon=True)
+        self._writer.start()
+
+    def _on_binding_called(self, event):
+        """Queue a payload the hooks flushed through the CDP binding"""
+        if event.name == _BINDING_NAME:
+            self._q.put(event.payload)
+
+    def _write_events(self):
+        """Drain queued binding payloads into the database in batches"""
+        get_nowait = self._q.get_nowait
+        while True:
+            batch = [self._q.get()]
+            while len(batch) < _WRITE_BATCH_SIZE:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
+
+            # None stops the writer; Events are flush markers
+            rows = self._decode_payloads(
+                item for item in batch if isinstance(item, str))
+            if rows:
+                try:
+                    self._insert_activities(rows)
+                except sqlite3.Error as e:
+                    print(f"Error writing JavaScript activities: {str(e)}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+    def _decode_payloads(self, payloads):
+        """Turn binding payloads into js_activities rows"""
+        rows = []
+        for payload in payloads:
+            # A malformed payload is skipped, not allowed to stop the
+            # writer for the rest of the session
+            try:
+                rows.extend(self._activity_rows(json.loads(payload)))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Error decoding JavaScript events: {str(e)}")
+        return rows
+
+    def flush(self):
+        """Block until every payload received so far has been written"""
+        if not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._q.put(done)
+        done.wait()
+
+    def _insert_activities(self, rows):
+        """Write a batch of JavaScript activity rows in one transaction"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('''
+                    INSERT INTO js_activities (
+                        timestamp, script_url, function_name, arguments,
+                        stack_trace, accessed_data, is_suspicious
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _activity_rows(self, batch):
+        """Decode a flushed page-side event log into js_activities rows"""
+        # Strings are interned per document and only sent the first time
+        doc = batch['doc']
+        strings = self._strings.get(doc)
+        if strings is None:
+            if len(self._strings) >= _MAX_TRACKED_DOCUMENTS:
+                del self._strings[next(iter(self._strings))]
+            strings = self._strings[doc] = []
+        strings.extend(batch['strings'])
+        origin = batch['origin']
+
+        rows = []
+        records = batch['records']
+        for i in range(0, len(records), _RECORD_SIZE):
+            code, url, key, at, stack = records[i:i + _RECORD_SIZE]
+            # Negative indexes would silently pick the wrong event or string
+            if min(code, url, key + 1, stack + 1) < 0:
+                raise IndexError(f"bad record {records[i:i + _RECORD_SIZE]}")
+            name = _EVENT_NAMES[code]
+            rows.append((
+                # Doubles cannot hold epoch nanoseconds; scale from whole
+                # microseconds, the most timeOrigin resolves
+                round((origin + at) * 1000) * 1000,
+                strings[url],
+                name,
+                None,
+                strings[stack] if stack >= 0 else None,
+                strings[key] if key >= 0 else None,
+                name in _SUSPICIOUS_EVENTS
+            ))
+
+        # The document has unloaded; its string table is no longer needed
+        if batch.get('end'):
+            self._strings.pop(doc, None)
+        return rows
 
     def monitor_script_execution(self, url):
         """Start monitoring JavaScript execution on a page"""
         try:
+            # The hooks are already registered for every new document
             self.driver.get(url)
-            self.inject_monitoring_code()
-            self._setup_event_listeners()
         except Exception as e:
             print(f"Error monitoring JavaScript execution: {str(e)}")
 
-    def _setup_event_listeners(self):
-        """Set up listeners for monitored JavaScript events"""
-        js_code = """
-        window.addEventListener('storageAccess', function(e) {
-            // Handle storage access events
-            console.log('Storage access:', JSON.stringify(e.detail));
-        });
-
-        window.addEventListener('xhrCall', function(e) {
-            // Handle XHR calls
-            console.log('XHR call:', JSON.stringify(e.detail));
-        });
-
-        window.addEventListener('fetchCall', function(e) {
-            // Handle fetch calls
-            console.log('Fetch call:', JSON.stringify(e.detail));
-        });
-
-        window.addEventListener('canvasCall', function(e) {
-            // Handle canvas API calls
-            console.log('Canvas call:', JSON.stringify(e.detail));
-        });
-        """
-        self.driver.execute_script(js_code)
-
     def analyze_script_behavior(self):
         """Analyze collected JavaScript behavior data"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        self.flush()
 
         # Analyze suspicious patterns
-        c.execute('''
+        suspicious_activities = self._query('''
             SELECT
                 script_url,
                 COUNT(*) as activity_count,
@@ -199,19 +405,13 @@ class JavaScriptMonitor:
             ORDER BY activity_count DESC
         ''')
 
-        suspicious_activities = c.fetchall()
-
         # Analyze script sources
-        c.execute('''
+        script_analysis = self._query('''
             SELECT url, classification, COUNT(*) as occurrence_count
             FROM script_sources
             GROUP BY url, classification
         ''')
 
-        script_analysis = c.fetchall()
-
-        conn.close()
-
         return {
             'suspicious_activities': suspicious_activities,
             'script_analysis': script_analysis
@@ -219,5 +419,11 @@ class JavaScriptMonitor:
 
     def cleanup(self):
         """Clean up resources"""
-        if self.driver:
+        # A shared browser outlives this monitor, so stop listening on it
+        self._devtools.remove_callback(self._binding_event, self._binding_callback)
+        # A shared browser is quit by its session
+        if self.driver and self.session is None:
             self.driver.quit()
+        self._q.put(None)
+        self._writer.join()
+        self._conn.close()
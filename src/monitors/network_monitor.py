@@ -1,16 +1,99 @@
 import sqlite3
-from datetime import datetime
 import json
-from urllib.parse import urlparse, parse_qs
+import threading
+import queue
+import re
+import time
+from collections import Counter, deque
+from urllib.parse import urlsplit, parse_qs
 from seleniumwire import webdriver
 from selenium.webdriver.chrome.options import Options
 
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; leak checks then use re
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
+if orjson is not None:
+    def _json_dumps(obj) -> str:
+        # Decode so values are stored as TEXT rather than BLOB
+        return orjson.dumps(obj).decode()
+else:
+    _json_dumps = json.dumps
+
+
+# WAL lets report queries read while the interceptor writes, and a relaxed
+# sync level makes each commit a cheap append
+_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA busy_timeout=5000'
+)
+
+# Substrings whose presence in a query parameter or header name marks a
+# request as carrying tracking data
+_TRACKING_INDICATORS = (
+    'id', 'uid', 'guid', 'uuid', 'tracking',
+    'analytics', 'visitor', 'client_id'
+)
+_TRACKING_NAME_RE = re.compile(
+    '|'.join(map(re.escape, _TRACKING_INDICATORS)), re.IGNORECASE)
+# Matches a tracking name in the name part of a key=value pair with a
+# non-empty value; parse_qs likewise drops blank and valueless fields
+_TRACKING_PARAM_RE = re.compile(
+    r'(?:^|[&;])[^=&;]*(?:%s)[^=&;]*=[^&;]' % '|'.join(map(re.escape, _TRACKING_INDICATORS)),
+    re.IGNORECASE)
+
+# Bumped when stored data changes format; kept in PRAGMA user_version
+_SCHEMA_VERSION = 1
+
+# Third-party requests this close together (in ns) count as data sharing
+_SHARING_WINDOW_NS = 60 * 60 * 1_000_000_000
+
+# Most queued rows the writer thread commits in one transaction
+_WRITE_BATCH_SIZE = 500
+
+
+def _cookie_value_matcher(values):
+    """Build a function returning the cookie values found in a string"""
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for value in values:
+            automaton.add_word(value, value)
+        automaton.make_automaton()
+        return lambda text: {value for _, value in automaton.iter(text)}
+
+    # One alternation rejects most strings in a single scan; only strings
+    # containing some value are checked value by value
+    combined = re.compile('|'.join(
+        re.escape(value) for value in sorted(values, key=len, reverse=True)))
+
+    def find(text):
+        if not combined.search(text):
+            return set()
+        return {value for value in values if value in text}
+    return find
+
 
 class NetworkMonitor:
-    def __init__(self, db_path="network_monitor.db"):
+    def __init__(self, db_path="network_monitor.db", session=None):
         self.db_path = db_path
+        # A SharedBrowserSession lets several monitors drive one browser
+        self.session = session
         self.setup_database()
-        self.setup_browser()
+        self._open_connection()
+        if session is not None:
+            self.driver = session.driver
+        else:
+            self.setup_browser()
 
     def setup_database(self):
         """Initialize database for network request tracking"""
@@ -25,7 +108,7 @@ class NetworkMonitor:
                 headers TEXT,
                 query_params TEXT,
                 post_data TEXT,
-                timestamp TIMESTAMP,
+                timestamp INTEGER,
                 response_status INTEGER,
                 response_headers TEXT,
                 domain TEXT,
@@ -34,9 +117,61 @@ class NetworkMonitor:
             )
         ''')
 
+        # Databases from before integer nanosecond timestamps hold the local
+        # ISO text of sqlite3's datetime adapter; convert those rows once
+        version, = c.execute('PRAGMA user_version').fetchone()
+        if version < _SCHEMA_VERSION:
+            c.execute('''
+                UPDATE requests
+                SET timestamp = CAST(ROUND(
+                    (julianday(timestamp, 'utc') - 2440587.5) * 86400000
+                ) AS INTEGER) * 1000000
+                WHERE typeof(timestamp) = 'text'
+            ''')
+            c.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+            conn.commit()
+
+        # Lets analyze_cross_domain_patterns walk third-party requests in
+        # time order straight from the index
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_requests_ts
+            ON requests(timestamp, domain) WHERE third_party = 1
+        ''')
+        # Partial covering indexes for the per-domain aggregations; rows
+        # outside the predicate add no index maintenance on insert
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_requests_tp_domain
+            ON requests(domain, url, contains_tracking_data) WHERE third_party = 1
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_requests_tracking_domain
+            ON requests(domain) WHERE contains_tracking_data = 1
+        ''')
+
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
         conn.commit()
         conn.close()
 
+    def _open_connection(self):
+        """Open the long-lived connection used for request writes"""
+        # Autocommit mode; batch writes open their own BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                     isolation_level=None, cached_statements=256)
+        for pragma in _PRAGMAS:
+            self._conn.execute(pragma)
+        self._lock = threading.Lock()
+        # Interceptors only enqueue raw values; serialization and SQLite
+        # writes happen on a single writer thread off the request path
+        self._q = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_rows, daemon=True)
+        self._writer.start()
+
+    def _query(self, query):
+        """Run a read query on the shared, tuned connection and return its rows"""
+        with self._lock:
+            return self._conn.execute(query).fetchall()
+
     def setup_browser(self):
         """Initialize browser with request interception"""
         chrome_options = Options()
@@ -45,89 +180,129 @@ class NetworkMonitor:
 
     def start_monitoring(self, base_url):
         """Start monitoring network requests"""
-        self.base_domain = urlparse(base_url).netloc
+        self.base_domain = urlsplit(base_url).netloc
+        base_domain = self.base_domain
 
         def request_interceptor(request):
             """Intercept and analyze outgoing requests"""
             try:
-                url_parts = urlparse(request.url)
-                is_third_party = url_parts.netloc != self.base_domain
+                # One split serves the domain check, tracking check and
+                # stored query parameters
+                url_parts = urlsplit(request.url)
+                query = url_parts.query
+                is_third_party = url_parts.netloc != base_domain
+                headers = dict(request.headers)
+
+                # Check for tracking indicators once; the result is stored
+                # with the request as well
+                contains_tracking = self._contains_tracking_data(query, headers)
 
                 # Store request data
                 self._store_request(
                     url=request.url,
                     method=request.method,
-                    headers=dict(request.headers),
-                    query_params=parse_qs(url_parts.query),
+                    headers=headers,
+                    query=query,
                     post_data=request.body,
                     domain=url_parts.netloc,
-                    is_third_party=is_third_party
+                    is_third_party=is_third_party,
+                    contains_tracking=contains_tracking
                 )
 
-                # Check for tracking indicators
-                if self._contains_tracking_data(request):
+                if contains_tracking:
                     self._log_tracking_attempt(request)
 
             except Exception as e:
                 print(f"Error intercepting request: {str(e)}")
 
-        self.driver.request_interceptor = request_interceptor
+        if self.session is not None:
+            self.session.add_request_interceptor(request_interceptor)
+        else:
+            self.driver.request_interceptor = request_interceptor
 
     def _store_request(self, **kwargs):
-        """Store request information in database"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
-        c.execute('''
-            INSERT INTO requests (
-                url, method, headers, query_params, post_data,
-                timestamp, domain, third_party, contains_tracking_data
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Queue request information for the database writer thread"""
+        self._q.put((
             kwargs['url'],
             kwargs['method'],
-            json.dumps(kwargs['headers']),
-            json.dumps(kwargs['query_params']),
+            kwargs['headers'],
+            kwargs['query'],
             kwargs.get('post_data'),
-            datetime.now(),
+            time.time_ns(),
             kwargs['domain'],
             kwargs['is_third_party'],
-            self._contains_tracking_data(kwargs)
+            kwargs['contains_tracking']
         ))
 
-        conn.commit()
-        conn.close()
-
-    def _contains_tracking_data(self, request_data):
+    def _request_row(self, item):
+        """Serialize a queued request into a requests table row"""
+        url, method, headers, query, post_data = item[:5]
+        return (url, method, _json_dumps(headers),
+                _json_dumps(parse_qs(query) if query else {}),
+                post_data) + item[5:]
+
+    def _write_rows(self):
+        """Drain queued requests into the database in batches"""
+        get_nowait = self._q.get_nowait
+        while True:
+            batch = [self._q.get()]
+            while len(batch) < _WRITE_BATCH_SIZE:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
+
+            # None stops the writer; Events are flush markers
+            rows = [self._request_row(item)
+                    for item in batch if isinstance(item, tuple)]
+            if rows:
+                try:
+                    self._insert_requests(rows)
+                except sqlite3.Error as e:
+                    print(f"Error writing requests: {str(e)}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+    def _insert_requests(self, rows):
+        """Write a batch of request rows in one transaction"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('''
+                    INSERT INTO requests (
+                        url, method, headers, query_params, post_data,
+                        timestamp, domain, third_party, contains_tracking_data
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def flush(self):
+        """Block until every request queued so far has been written"""
+        if not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._q.put(done)
+        done.wait()
+
+    def _contains_tracking_data(self, query: str, headers: dict) -> bool:
         """Check if request contains potential tracking data"""
-        tracking_indicators = [
-            'id', 'uid', 'guid', 'uuid', 'tracking',
-            'analytics', 'visitor', 'client_id'
-        ]
-
-        # Check URL parameters
-        url_parts = urlparse(request_data['url'])
-        params = parse_qs(url_parts.query)
-
-        for param in params:
-            if any(indicator in param.lower() for indicator in tracking_indicators):
-                return True
-
-        # Check headers
-        headers = request_data['headers']
-        for header, value in headers.items():
-            if any(indicator in header.lower() for indicator in tracking_indicators):
-                return True
-
-        return False
+        # Check URL parameter names, then header names
+        if query and _TRACKING_PARAM_RE.search(query):
+            return True
+        return any(_TRACKING_NAME_RE.search(header) for header in headers)
 
     def analyze_cross_domain_patterns(self):
         """Analyze patterns in cross-domain communications"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        self.flush()
 
         # Analyze third-party request patterns
-        c.execute('''
+        domain_patterns = self._query('''
             SELECT
                 domain,
                 COUNT(*) as request_count,
@@ -139,57 +314,79 @@ class NetworkMonitor:
             ORDER BY request_count DESC
         ''')
 
-        domain_patterns = c.fetchall()
-
-        # Analyze data sharing patterns
-        c.execute('''
-            SELECT
-                r1.domain as source_domain,
-                r2.domain as destination_domain,
-                COUNT(*) as connection_count
-            FROM requests r1
-            JOIN requests r2 ON r1.id < r2.id
-                AND ABS(JULIANDAY(r2.timestamp) - JULIANDAY(r1.timestamp)) < 1/24.0
-            WHERE r1.third_party = 1 AND r2.third_party = 1
-            GROUP BY r1.domain, r2.domain
-            HAVING connection_count > 1
-        ''')
-
-        data_sharing_patterns = c.fetchall()
-
-        conn.close()
+        # Analyze data sharing patterns: pair each request with the
+        # earlier ones inside the window in a single time-ordered pass
+        pair_counts = Counter()
+        window = deque()
+        window_domains = Counter()
+        for domain, timestamp in self._query('''
+            SELECT domain, timestamp
+            FROM requests
+            WHERE third_party = 1 AND typeof(timestamp) = 'integer'
+            ORDER BY timestamp
+        '''):
+            while window and timestamp - window[0][1] >= _SHARING_WINDOW_NS:
+                old_domain = window.popleft()[0]
+                window_domains[old_domain] -= 1
+                if not window_domains[old_domain]:
+                    del window_domains[old_domain]
+            for source, count in window_domains.items():
+                pair_counts[(source, domain)] += count
+            window.append((domain, timestamp))
+            window_domains[domain] += 1
+
+        data_sharing_patterns = sorted(
+            (source, destination, count)
+            for (source, destination), count in pair_counts.items()
+            if count > 1)
 
         return {
             'domain_patterns': domain_patterns,
             'data_sharing_patterns': data_sharing_patterns
         }
 
-    def detect_cookie_leakage(self):
+    def detect_cookie_leakage(self, cookie_db="cookie_monitor.db"):
         """Detect potential cookie data being leaked in requests"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        self.flush()
 
         # Get all cookies from cookie database (assuming it exists)
-        c.execute('''
-            ATTACH DATABASE 'cookie_monitor.db' AS cookies;
-
-            SELECT DISTINCT r.url, r.domain, r.query_params, c.value
-            FROM requests r
-            JOIN cookies.cookies c
-            WHERE r.query_params LIKE '%' || c.value || '%'
-            AND r.third_party = 1
-        ''')
-
-        leaked_cookies = c.fetchall()
-        conn.close()
+        try:
+            cookie_conn = sqlite3.connect(cookie_db)
+            values = {row[0] for row in cookie_conn.execute('''
+                SELECT DISTINCT value FROM cookies
+                WHERE value IS NOT NULL AND value != ''
+            ''')}
+            cookie_conn.close()
+        except sqlite3.Error as e:
+            print(f"Error reading cookies from {cookie_db}: {str(e)}")
+            return []
+
+        if not values:
+            return []
+        find_values = _cookie_value_matcher(values)
+
+        # Match every third-party request against all cookie values at once
+        # instead of a LIKE per (request, cookie) pair
+        leaked_cookies = []
+        with self._lock:
+            c = self._conn.cursor()
+            c.execute('''
+                SELECT DISTINCT url, domain, query_params
+                FROM requests
+                WHERE third_party = 1
+            ''')
+            for rows in iter(lambda: c.fetchmany(4096), []):
+                for url, domain, query_params in rows:
+                    if not query_params:
+                        continue
+                    for value in find_values(query_params):
+                        leaked_cookies.append((url, domain, query_params, value))
 
         return leaked_cookies
 
     def generate_report(self):
         """Generate a comprehensive report of network activity"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-
+        self.flush()
         report = {
             'total_requests': 0,
             'third_party_requests': 0,
@@ -198,40 +395,46 @@ class NetworkMonitor:
             'suspicious_patterns': []
         }
 
-        # Get basic statistics
-        c.execute('''
-            SELECT
-                COUNT(*) as total,
-                SUM(third_party) as third_party,
-                SUM(contains_tracking_data) as tracking,
-                COUNT(DISTINCT domain) as domains
-            FROM requests
-        ''')
-
-        stats = c.fetchone()
-        report.update({
-            'total_requests': stats[0],
-            'third_party_requests': stats[1],
-            'tracking_requests': stats[2],
-            'unique_domains': stats[3]
-        })
+        with self._lock:
+            c = self._conn.cursor()
+
+            # Get basic statistics
+            c.execute('''
+                SELECT
+                    COUNT(*) as total,
+                    SUM(third_party) as third_party,
+                    SUM(contains_tracking_data) as tracking,
+                    COUNT(DISTINCT domain) as domains
+                FROM requests
+            ''')
+
+            stats = c.fetchone()
+            report.update({
+                'total_requests': stats[0],
+                'third_party_requests': stats[1],
+                'tracking_requests': stats[2],
+                'unique_domains': stats[3]
+            })
+
+            # Get suspicious patterns
+            c.execute('''
+                SELECT domain, COUNT(*) as count
+                FROM requests
+                WHERE contains_tracking_data = 1
+                GROUP BY domain
+                ORDER BY count DESC
+                LIMIT 10
+            ''')
+
+            report['top_tracking_domains'] = c.fetchall()
 
-        # Get suspicious patterns
-        c.execute('''
-            SELECT domain, COUNT(*) as count
-            FROM requests
-            WHERE contains_tracking_data = 1
-            GROUP BY domain
-            ORDER BY count DESC
-            LIMIT 10
-        ''')
-
-        report['top_tracking_domains'] = c.fetchall()
-
-        conn.close()
         return report
 
     def cleanup(self):
         """Clean up resources"""
-        if self.driver:
+        # A shared browser is quit by its session
+        if self.driver and self.session is None:
             self.driver.quit()
+        self._q.put(None)
+        self._writer.join()
+        self._conn.close()
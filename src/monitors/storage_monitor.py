@@ -1,15 +1,96 @@
 import sqlite3
-from datetime import datetime
 import json
+import time
+import threading
+import queue
 from seleniumwire import webdriver
 from selenium.webdriver.chrome.options import Options
+from browser_session import register_init_script
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
+if orjson is not None:
+    def _json_dumps(obj) -> str:
+        # Decode so values are stored as TEXT rather than BLOB
+        return orjson.dumps(obj).decode()
+else:
+    _json_dumps = json.dumps
+
+
+# WAL lets report queries read while the interceptor writes, and a relaxed
+# sync level makes each commit a cheap append
+_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA busy_timeout=5000'
+)
+
+# Most queued rows the writer thread commits in one transaction
+_WRITE_BATCH_SIZE = 500
+
+# Bumped when stored data changes format; kept in PRAGMA user_version
+_SCHEMA_VERSION = 1
+
+
+# Storage and canvas hooks, registered to run before any page script
+_STORAGE_HOOKS_SCRIPT = """
+(function() {
+    let originalSetItem = Storage.prototype.setItem;
+    let originalGetItem = Storage.prototype.getItem;
+    let originalRemoveItem = Storage.prototype.removeItem;
+
+    Storage.prototype.setItem = function(key, value) {
+        window.dispatchEvent(new CustomEvent('storageModified', {
+            detail: {
+                type: 'localStorage',
+                action: 'set',
+                key: key,
+                value: value
+            }
+        }));
+        originalSetItem.call(this, key, value);
+    };
+
+    // Add similar monitoring for getItem and removeItem
+})();
+
+(function() {
+    // Monitor Canvas API usage
+    let originalGetImageData = CanvasRenderingContext2D.prototype.getImageData;
+    CanvasRenderingContext2D.prototype.getImageData = function(...args) {
+        window.dispatchEvent(new CustomEvent('fingerprintAttempt', {
+            detail: {
+                type: 'canvas',
+                method: 'getImageData'
+            }
+        }));
+        return originalGetImageData.apply(this, args);
+    };
+
+    // Monitor WebGL API usage
+    // Add similar monitoring for WebGL contexts
+})();
+"""
 
 
 class StorageMonitor:
-    def __init__(self, db_path="storage_monitor.db"):
+    def __init__(self, db_path="storage_monitor.db", session=None):
         self.db_path = db_path
+        # A SharedBrowserSession lets several monitors drive one browser
+        self.session = session
         self.setup_database()
-        self.setup_browser()
+        self._open_connection()
+        if session is not None:
+            self.driver = session.driver
+        else:
+            self.setup_browser()
+        self._register_hooks()
 
     def setup_database(self):
         """Initialize SQLite database for storage tracking"""
@@ -23,7 +104,7 @@ class StorageMonitor:
                 domain TEXT,
                 key TEXT,
                 value TEXT,
-                timestamp TIMESTAMP,
+                timestamp INTEGER,
                 action TEXT
             )
         ''')
@@ -35,7 +116,7 @@ class StorageMonitor:
                 domain TEXT,
                 key TEXT,
                 value TEXT,
-                timestamp TIMESTAMP,
+                timestamp INTEGER,
                 action TEXT
             )
         ''')
@@ -46,14 +127,68 @@ class StorageMonitor:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 url TEXT,
                 etag TEXT,
-                timestamp TIMESTAMP,
+                timestamp INTEGER,
                 response_headers TEXT
             )
         ''')
 
+        # Databases from before integer nanosecond timestamps hold the local
+        # ISO text of sqlite3's datetime adapter, which sorts above every
+        # integer; convert those rows once
+        version, = c.execute('PRAGMA user_version').fetchone()
+        if version < _SCHEMA_VERSION:
+            for table in ('local_storage', 'session_storage', 'etags'):
+                c.execute(f'''
+                    UPDATE {table}
+                    SET timestamp = CAST(ROUND(
+                        (julianday(timestamp, 'utc') - 2440587.5) * 86400000
+                    ) AS INTEGER) * 1000000
+                    WHERE typeof(timestamp) = 'text'
+                ''')
+            c.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+            conn.commit()
+
+        # Covering indexes for the GROUP BY queries in analyze_storage_patterns
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ls_domain_key
+            ON local_storage(domain, key)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_etags_url
+            ON etags(url, etag)
+        ''')
+
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
         conn.commit()
         conn.close()
 
+    def _open_connection(self):
+        """Open the long-lived connection used for ETag writes"""
+        # Autocommit mode; batch writes open their own BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                     isolation_level=None, cached_statements=256)
+        for pragma in _PRAGMAS:
+            self._conn.execute(pragma)
+        self._lock = threading.Lock()
+        # Interceptors only enqueue raw values; serialization and SQLite
+        # writes happen on a single writer thread off the request path
+        self._q = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_rows, daemon=True)
+        self._writer.start()
+
+    def _query(self, query):
+        """Run a read query on the shared, tuned connection and return its rows"""
+        with self._lock:
+            return self._conn.execute(query).fetchall()
+
+    def _register_hooks(self):
+        """Have the hook script run before any page script on every navigation"""
+        if self.session is not None:
+            self.session.add_init_script(_STORAGE_HOOKS_SCRIPT)
+        else:
+            register_init_script(self.driver, _STORAGE_HOOKS_SCRIPT)
+
     def setup_browser(self):
         """Initialize browser with storage monitoring capabilities"""
         chrome_options = Options()
@@ -64,29 +199,6 @@ class StorageMonitor:
         """Monitor LocalStorage activities"""
         try:
             self.driver.get(url)
-            js_code = """
-            (function() {
-                let originalSetItem = Storage.prototype.setItem;
-                let originalGetItem = Storage.prototype.getItem;
-                let originalRemoveItem = Storage.prototype.removeItem;
-
-                Storage.prototype.setItem = function(key, value) {
-                    window.dispatchEvent(new CustomEvent('storageModified', {
-                        detail: {
-                            type: 'localStorage',
-                            action: 'set',
-                            key: key,
-                            value: value
-                        }
-                    }));
-                    originalSetItem.call(this, key, value);
-                };
-
-                // Add similar monitoring for getItem and removeItem
-            })();
-            """
-            self.driver.execute_script(js_code)
-
             # Set up event listener for storage events
             self._setup_storage_listener()
 
@@ -100,53 +212,71 @@ class StorageMonitor:
                 self._store_etag(
                     request.url,
                     response.headers['etag'],
-                    json.dumps(dict(response.headers))
+                    dict(response.headers)
                 )
 
-        self.driver.response_interceptor = response_interceptor
+        if self.session is not None:
+            self.session.add_response_interceptor(response_interceptor)
+        else:
+            self.driver.response_interceptor = response_interceptor
 
     def _store_etag(self, url, etag, headers):
-        """Store ETag information in database"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        """Queue ETag information for the database writer thread"""
+        self._q.put((url, etag, time.time_ns(), headers))
 
-        c.execute('''
-            INSERT INTO etags (url, etag, timestamp, response_headers)
-            VALUES (?, ?, ?, ?)
-        ''', (url, etag, datetime.now(), headers))
+    def _write_rows(self):
+        """Drain queued ETags into the database in batches"""
+        get_nowait = self._q.get_nowait
+        while True:
+            batch = [self._q.get()]
+            while len(batch) < _WRITE_BATCH_SIZE:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
 
-        conn.commit()
-        conn.close()
+            # None stops the writer; Events are flush markers
+            rows = [item[:3] + (_json_dumps(item[3]),)
+                    for item in batch if isinstance(item, tuple)]
+            if rows:
+                try:
+                    self._insert_etags(rows)
+                except sqlite3.Error as e:
+                    print(f"Error writing ETags: {str(e)}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
 
-    def detect_fingerprinting(self):
-        """Detect potential fingerprinting attempts"""
-        js_code = """
-        (function() {
-            // Monitor Canvas API usage
-            let originalGetImageData = CanvasRenderingContext2D.prototype.getImageData;
-            CanvasRenderingContext2D.prototype.getImageData = function() {
-                window.dispatchEvent(new CustomEvent('fingerprintAttempt', {
-                    detail: {
-                        type: 'canvas',
-                        method: 'getImageData'
-                    }
-                }));
-                return originalGetImageData.apply(this, arguments);
-            };
-
-            // Monitor WebGL API usage
-            // Add similar monitoring for WebGL contexts
-        })();
-        """
-        self.driver.execute_script(js_code)
+    def _insert_etags(self, rows):
+        """Write a batch of ETag rows in one transaction"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('''
+                    INSERT INTO etags (url, etag, timestamp, response_headers)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def flush(self):
+        """Block until every ETag queued so far has been written"""
+        if not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._q.put(done)
+        done.wait()
 
     def analyze_storage_patterns(self):
         """Analyze storage usage patterns to detect tracking behavior"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        self.flush()
 
         # Analyze LocalStorage patterns
-        c.execute('''
+        frequent_changes = self._query('''
             SELECT domain, key, COUNT(*) as changes
             FROM local_storage
             GROUP BY domain, key
@@ -154,20 +284,14 @@ class StorageMonitor:
             ORDER BY changes DESC
         ''')
 
-        frequent_changes = c.fetchall()
-
         # Analyze ETag patterns
-        c.execute('''
+        suspicious_etags = self._query('''
             SELECT url, COUNT(DISTINCT etag) as unique_etags
             FROM etags
             GROUP BY url
             HAVING unique_etags > 1
         ''')
 
-        suspicious_etags = c.fetchall()
-
-        conn.close()
-
         return {
             'frequent_storage_changes': frequent_changes,
             'suspicious_etag_patterns': suspicious_etags
@@ -175,5 +299,9 @@ class StorageMonitor:
 
     def cleanup(self):
         """Clean up resources"""
-        if self.driver:
+        # A shared browser is quit by its session
+        if self.driver and self.session is None:
             self.driver.quit()
+        self._q.put(None)
+        self._writer.join()
+        self._conn.close()
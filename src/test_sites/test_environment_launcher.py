@@ -1,4 +1,5 @@
 import os
+import threading
 from tracking_test_sites import TrackingTestSites
 
 
@@ -25,11 +26,12 @@ def main():
     try:
         test_sites.run()
         print("\nPress Ctrl+C to stop the test environment")
-        # Keep the main thread alive
-        while True:
-            pass
+        # Keep the main thread alive, sleeping until interrupted
+        threading.Event().wait()
     except KeyboardInterrupt:
         print("\nShutting down test environment...")
+    finally:
+        test_sites.cleanup()
 
 
 if __name__ == "__main__":
@@ -1,13 +1,314 @@
-from flask import Flask, request, make_response, render_template_string, jsonify
 import uuid
 import os
 import json
+import logging
+import gzip
+import socket
+import multiprocessing
+import tempfile
+import time
+import threading
+from collections import deque
+from string import Template
+
+# Seconds browsers may reuse the tracker scripts
+_JS_MAX_AGE = 3600
+
+# Pending analytics events beyond this are refused with 503
+_EVENT_QUEUE_LIMIT = 10000
+# Seconds between moves of queued events into stored_data
+_EVENT_FLUSH_INTERVAL = 0.05
+# Largest analytics event body accepted; canvas fingerprints are data URLs
+_MAX_EVENT_BYTES = 1 << 20
+
+# Constant /event replies, serialized once; the accepted reply has no
+# body so it fits in one segment on the kept-alive socket
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+_EVENT_ACCEPTED = (b'', 204)
+_EVENT_BUSY = (b'{"status":"busy"}', 503, _JSON_HEADERS)
+_EVENT_TOO_LARGE = (b'{"status":"too large"}', 413, _JSON_HEADERS)
+_EVENT_INVALID = (b'{"status":"invalid"}', 400, _JSON_HEADERS)
+
+# Worker threads per site when served by waitress
+_WAITRESS_THREADS = 32
+# Pending-connection queue length for each gevent listening socket
+_LISTEN_BACKLOG = 2048
+
+try:
+    from gevent.pywsgi import WSGIServer
+    from gevent.socket import socket as gevent_socket
+except ImportError:
+    WSGIServer = gevent_socket = None
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+try:
+    import rjsmin
+except ImportError:  # minifiers are optional; bodies are then served as written
+    rjsmin = None
+
+try:
+    import htmlmin
+except ImportError:
+    htmlmin = None
+
+
+def _minify_js(source):
+    """Minify a script when rjsmin is available"""
+    return rjsmin.jsmin(source) if rjsmin is not None else source
+
+
+def _minify_html(source):
+    """Minify a page when htmlmin is available"""
+    if htmlmin is None:
+        return source
+    return htmlmin.minify(source, remove_comments=True)
+
+
+def _listen_socket(port):
+    """Open a gevent listening socket that other workers may also bind"""
+    sock = gevent_socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # The kernel spreads new connections across every bound worker
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('127.0.0.1', port))
+    sock.listen(_LISTEN_BACKLOG)
+    return sock
+
+
+def _install_orjson_provider(app):
+    """Back app.json with orjson so jsonify and get_json skip the stdlib codec"""
+    if orjson is None:
+        return
+    # Defined here because Flask itself is only imported lazily
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            # Dates go through Flask's default to keep its RFC 822 http_date
+            # form rather than orjson's RFC 3339 one; keys stay sorted as
+            # sort_keys asks
+            option = orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=option).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
+
+def _mount(app, prefix):
+    """WSGI app serving the blueprint at prefix as the root of its own port"""
+    def application(environ, start_response):
+        environ['PATH_INFO'] = prefix + environ.get('PATH_INFO', '')
+        return app(environ, start_response)
+    return application
+
+
+def _accepts_gzip(headers):
+    """Whether a request with these headers accepts a gzip-encoded body"""
+    return 'gzip' in headers.get('Accept-Encoding', '')
+
+
+# Main test page; $third_party_port and $analytics_port are the other sites' ports
+_MAIN_HTML_TMPL = Template('''\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Test Site - Main</title>
+    <script src="http://localhost:$third_party_port/tracker.js"></script>
+    <script src="http://localhost:$analytics_port/analytics.js"></script>
+</head>
+<body>
+    <h1>Test Site</h1>
+    <div id="content">
+        <p>This is a test page with various tracking implementations.</p>
+        <button onclick="simulateUserAction()">Simulate User Action</button>
+    </div>
+
+    <script>
+        // First-party cookie implementation
+        function setCookie(name, value, days) {
+            let expires = "";
+            if (days) {
+                const date = new Date();
+                date.setTime(date.getTime() + (days * 24 * 60 * 60 * 1000));
+                expires = "; expires=" + date.toUTCString();
+            }
+            document.cookie = name + "=" + value + expires + "; path=/";
+        }
+
+        // Set initial first-party cookie
+        if (!document.cookie.includes('visitor_id')) {
+            setCookie('visitor_id', 'fp_' + Math.random().toString(36).substr(2, 9), 30);
+        }
+
+        // Local Storage implementation
+        function setupLocalStorage() {
+            if (!localStorage.getItem('user_profile')) {
+                localStorage.setItem('user_profile', JSON.stringify({
+                    id: 'ls_' + Math.random().toString(36).substr(2, 9),
+                    firstVisit: new Date().toISOString(),
+                    visits: 1
+                }));
+            } else {
+                let profile = JSON.parse(localStorage.getItem('user_profile'));
+                profile.visits += 1;
+                localStorage.setItem('user_profile', JSON.stringify(profile));
+            }
+        }
+
+        // Canvas fingerprinting implementation
+        function generateCanvasFingerprint() {
+            const canvas = document.createElement('canvas');
+            const ctx = canvas.getContext('2d');
+            ctx.textBaseline = "top";
+            ctx.font = "14px 'Arial'";
+            ctx.textBaseline = "alphabetic";
+            ctx.fillStyle = "#f60";
+            ctx.fillRect(125,1,62,20);
+            ctx.fillStyle = "#069";
+            ctx.fillText("Hello, world!", 2, 15);
+            ctx.fillStyle = "rgba(102, 204, 0, 0.7)";
+            ctx.fillText("Hello, world!", 4, 17);
+
+            return canvas.toDataURL();
+        }
+
+        // Monitor and simulate user behavior
+        function simulateUserAction() {
+            // Update local storage
+            let profile = JSON.parse(localStorage.getItem('user_profile'));
+            profile.lastAction = new Date().toISOString();
+            localStorage.setItem('user_profile', JSON.stringify(profile));
+
+            // Send data to analytics
+            fetch('http://localhost:$analytics_port/event', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    event: 'button_click',
+                    timestamp: new Date().toISOString(),
+                    fingerprint: generateCanvasFingerprint()
+                })
+            });
+        }
+
+        // Initialize tracking
+        setupLocalStorage();
+    </script>
+</body>
+</html>
+''')
+
+# Third-party tracker script; $port is the tracker site's port
+_TRACKER_JS_TMPL = Template('''\
+// Third-party tracking implementation
+(function() {
+    function generateTrackingId() {
+        return 'tp_' + Math.random().toString(36).substr(2, 9);
+    }
+
+    function setThirdPartyCookie() {
+        document.cookie = "tp_tracker=" + generateTrackingId() + "; path=/; max-age=31536000";
+    }
+
+    // Cookie syncing implementation
+    function syncCookies() {
+        const img = new Image();
+        img.src = 'http://localhost:$port/sync?' +
+                'first_party_id=' + encodeURIComponent(document.cookie) +
+                '&referrer=' + encodeURIComponent(document.referrer);
+    }
+
+    // Initialize tracking
+    setThirdPartyCookie();
+    syncCookies();
+
+    // Set up respawning mechanism
+    window.addEventListener('storage', function(e) {
+        if (e.key === 'tp_tracker_backup') {
+            setThirdPartyCookie();
+        }
+    });
+
+    // Backup tracking ID to localStorage
+    localStorage.setItem('tp_tracker_backup', document.cookie);
+})();
+''')
+
+# Analytics script; $port is the analytics site's port
+_ANALYTICS_JS_TMPL = Template('''\
+// Analytics implementation
+(function() {
+    function collectBrowserData() {
+        return {
+            userAgent: navigator.userAgent,
+            language: navigator.language,
+            screenResolution: window.screen.width + 'x' + window.screen.height,
+            timezone: Intl.DateTimeFormat().resolvedOptions().timeZone,
+            plugins: Array.from(navigator.plugins).map(p => p.name)
+        };
+    }
+
+    function generateFingerprint() {
+        const browserData = collectBrowserData();
+        return btoa(JSON.stringify(browserData));
+    }
+
+    // Initialize analytics
+    const analyticsId = generateFingerprint();
+    localStorage.setItem('analytics_id', analyticsId);
+
+    // Send initial pageview
+    fetch('http://localhost:$port/event', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            type: 'pageview',
+            fingerprint: analyticsId,
+            url: window.location.href,
+            timestamp: new Date().toISOString(),
+            browserData: collectBrowserData()
+        })
+    });
+})();
+''')
 
 
 class TrackingTestSites:
-    def __init__(self, port_start=8000):
+    def __init__(self, port_start=8000, max_events=100_000, workers=1):
         self.port_start = port_start
-        self.apps = {}
+        self.max_events = max_events
+        self.workers = workers
+        # Flask is imported here rather than at module level so importing
+        # this module stays cheap until sites are actually built
+        from flask import Flask
+        # One Flask app holds every site as a blueprint; each site still
+        # gets its own port so the trackers stay third-party origins
+        self.app = Flask('tracking_test_sites')
+        # Hand errors straight to the server and drop per-request logging
+        self.app.config['PROPAGATE_EXCEPTIONS'] = True
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        _install_orjson_provider(self.app)
+        self.sites = {}
         self.setup_sites()
 
     def setup_sites(self):
@@ -18,147 +319,76 @@ class TrackingTestSites:
         self.create_third_party_site()
         # Analytics site
         self.create_analytics_site()
+        # Serve the generated scripts as files so they get ETags and 304s,
+        # each next to a copy compressed once here rather than per request;
+        # the directory is removed by cleanup, or at exit if that never runs
+        self._js_tmp = tempfile.TemporaryDirectory(prefix='tracking_test_sites_')
+        self._js_dir = self._js_tmp.name
+        for name, body in (('tracker.js', self._tracker_js),
+                           ('analytics.js', self._analytics_js)):
+            with open(os.path.join(self._js_dir, name), 'wb') as f:
+                f.write(body)
+            with open(os.path.join(self._js_dir, name + '.gz'), 'wb') as f:
+                f.write(gzip.compress(body, compresslevel=9))
+
+    def _start_event_flusher(self):
+        """Start the thread moving queued analytics events into storage"""
+        threading.Thread(target=self._flush_events, daemon=True).start()
+
+    def _send_script(self, name):
+        """Send a generated script, precompressed if the client accepts gzip"""
+        from flask import request, send_from_directory
+        if _accepts_gzip(request.headers):
+            response = send_from_directory(self._js_dir, name + '.gz',
+                                           mimetype='application/javascript',
+                                           max_age=_JS_MAX_AGE)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(self._js_dir, name,
+                                           mimetype='application/javascript',
+                                           max_age=_JS_MAX_AGE)
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    def _register_site(self, name, blueprint):
+        """Add a site's blueprint to the shared app"""
+        self.app.register_blueprint(blueprint)
+        self.sites[name] = blueprint.url_prefix
 
     def create_main_site(self):
-        app = Flask('main_site')
+        from flask import Blueprint, Response, request
+        bp = Blueprint('main', __name__, url_prefix='/main')
 
-        @app.route('/')
+        # The page only depends on the ports, so fill it in once up front
+        rendered = _MAIN_HTML_TMPL.substitute(third_party_port=self.port_start + 1,
+                                              analytics_port=self.port_start + 2)
+        self._main_html = _minify_html(rendered).encode()
+        self._main_html_gz = gzip.compress(self._main_html, compresslevel=9)
+
+        @bp.route('/')
         def main_home():
-            return render_template_string('''
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Test Site - Main</title>
-                    <script src="http://localhost:{{third_party_port}}/tracker.js"></script>
-                    <script src="http://localhost:{{analytics_port}}/analytics.js"></script>
-                </head>
-                <body>
-                    <h1>Test Site</h1>
-                    <div id="content">
-                        <p>This is a test page with various tracking implementations.</p>
-                        <button onclick="simulateUserAction()">Simulate User Action</button>
-                    </div>
-
-                    <script>
-                        // First-party cookie implementation
-                        function setCookie(name, value, days) {
-                            let expires = "";
-                            if (days) {
-                                const date = new Date();
-                                date.setTime(date.getTime() + (days * 24 * 60 * 60 * 1000));
-                                expires = "; expires=" + date.toUTCString();
-                            }
-                            document.cookie = name + "=" + value + expires + "; path=/";
-                        }
-
-                        // Set initial first-party cookie
-                        if (!document.cookie.includes('visitor_id')) {
-                            setCookie('visitor_id', 'fp_' + Math.random().toString(36).substr(2, 9), 30);
-                        }
-
-                        // Local Storage implementation
-                        function setupLocalStorage() {
-                            if (!localStorage.getItem('user_profile')) {
-                                localStorage.setItem('user_profile', JSON.stringify({
-                                    id: 'ls_' + Math.random().toString(36).substr(2, 9),
-                                    firstVisit: new Date().toISOString(),
-                                    visits: 1
-                                }));
-                            } else {
-                                let profile = JSON.parse(localStorage.getItem('user_profile'));
-                                profile.visits += 1;
-                                localStorage.setItem('user_profile', JSON.stringify(profile));
-                            }
-                        }
-
-                        // Canvas fingerprinting implementation
-                        function generateCanvasFingerprint() {
-                            const canvas = document.createElement('canvas');
-                            const ctx = canvas.getContext('2d');
-                            ctx.textBaseline = "top";
-                            ctx.font = "14px 'Arial'";
-                            ctx.textBaseline = "alphabetic";
-                            ctx.fillStyle = "#f60";
-                            ctx.fillRect(125,1,62,20);
-                            ctx.fillStyle = "#069";
-                            ctx.fillText("Hello, world!", 2, 15);
-                            ctx.fillStyle = "rgba(102, 204, 0, 0.7)";
-                            ctx.fillText("Hello, world!", 4, 17);
-
-                            return canvas.toDataURL();
-                        }
-
-                        // Monitor and simulate user behavior
-                        function simulateUserAction() {
-                            // Update local storage
-                            let profile = JSON.parse(localStorage.getItem('user_profile'));
-                            profile.lastAction = new Date().toISOString();
-                            localStorage.setItem('user_profile', JSON.stringify(profile));
-
-                            // Send data to analytics
-                            fetch('http://localhost:{{analytics_port}}/event', {
-                                method: 'POST',
-                                headers: {
-                                    'Content-Type': 'application/json',
-                                },
-                                body: JSON.stringify({
-                                    event: 'button_click',
-                                    timestamp: new Date().toISOString(),
-                                    fingerprint: generateCanvasFingerprint()
-                                })
-                            });
-                        }
-
-                        // Initialize tracking
-                        setupLocalStorage();
-                    </script>
-                </body>
-                </html>
-            ''', third_party_port=self.port_start + 1, analytics_port=self.port_start + 2)
-
-        self.apps['main'] = app
+            if _accepts_gzip(request.headers):
+                response = Response(self._main_html_gz, mimetype='text/html')
+                response.headers['Content-Encoding'] = 'gzip'
+            else:
+                response = Response(self._main_html, mimetype='text/html')
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+
+        self._register_site('main', bp)
 
     def create_third_party_site(self):
-        app = Flask('third_party_site')
+        from flask import Blueprint, make_response
+        bp = Blueprint('third_party', __name__, url_prefix='/third_party')
 
-        @app.route('/tracker.js')
+        self._tracker_js = _minify_js(
+            _TRACKER_JS_TMPL.substitute(port=self.port_start + 1)).encode()
+
+        @bp.route('/tracker.js')
         def tracker_js():
-            return '''
-                // Third-party tracking implementation
-                (function() {
-                    function generateTrackingId() {
-                        return 'tp_' + Math.random().toString(36).substr(2, 9);
-                    }
-
-                    function setThirdPartyCookie() {
-                        document.cookie = "tp_tracker=" + generateTrackingId() + "; path=/; max-age=31536000";
-                    }
-
-                    // Cookie syncing implementation
-                    function syncCookies() {
-                        const img = new Image();
-                        img.src = 'http://localhost:''' + str(self.port_start + 1) + '''/sync?' +
-                                'first_party_id=' + encodeURIComponent(document.cookie) +
-                                '&referrer=' + encodeURIComponent(document.referrer);
-                    }
-
-                    // Initialize tracking
-                    setThirdPartyCookie();
-                    syncCookies();
-
-                    // Set up respawning mechanism
-                    window.addEventListener('storage', function(e) {
-                        if (e.key === 'tp_tracker_backup') {
-                            setThirdPartyCookie();
-                        }
-                    });
-
-                    // Backup tracking ID to localStorage
-                    localStorage.setItem('tp_tracker_backup', document.cookie);
-                })();
-            '''
-
-        @app.route('/sync')
+            return self._send_script('tracker.js')
+
+        @bp.route('/sync')
         def sync():
             # Simulate cookie syncing
             response = make_response('pixel.gif')
@@ -166,74 +396,110 @@ class TrackingTestSites:
             # Store the mapping between first-party and third-party IDs
             return response
 
-        self.apps['third_party'] = app
+        self._register_site('third_party', bp)
 
     def create_analytics_site(self):
-        app = Flask('analytics_site')
-        stored_data = []
-
-        @app.route('/analytics.js')
+        from flask import Blueprint, request
+        bp = Blueprint('analytics', __name__, url_prefix='/analytics')
+        # Keep only the most recent events so a long run stays bounded
+        stored_data = deque(maxlen=self.max_events)
+        # Handlers only append to the queue; a flusher moves events into
+        # stored_data in batches
+        event_queue = deque()
+
+        def flush_events():
+            while True:
+                time.sleep(_EVENT_FLUSH_INTERVAL)
+                # popleft rather than list()+clear() so events appended
+                # mid-drain are not lost
+                batch = []
+                while event_queue:
+                    batch.append(event_queue.popleft())
+                stored_data.extend(batch)
+
+        self._flush_events = flush_events
+        self._start_event_flusher()
+
+        self._analytics_js = _minify_js(
+            _ANALYTICS_JS_TMPL.substitute(port=self.port_start + 2)).encode()
+
+        @bp.route('/analytics.js')
         def analytics_js():
-            return '''
-                // Analytics implementation
-                (function() {
-                    function collectBrowserData() {
-                        return {
-                            userAgent: navigator.userAgent,
-                            language: navigator.language,
-                            screenResolution: window.screen.width + 'x' + window.screen.height,
-                            timezone: Intl.DateTimeFormat().resolvedOptions().timeZone,
-                            plugins: Array.from(navigator.plugins).map(p => p.name)
-                        };
-                    }
-
-                    function generateFingerprint() {
-                        const browserData = collectBrowserData();
-                        return btoa(JSON.stringify(browserData));
-                    }
-
-                    // Initialize analytics
-                    const analyticsId = generateFingerprint();
-                    localStorage.setItem('analytics_id', analyticsId);
-
-                    // Send initial pageview
-                    fetch('http://localhost:''' + str(self.port_start + 2) + '''/event', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({
-                            type: 'pageview',
-                            fingerprint: analyticsId,
-                            url: window.location.href,
-                            timestamp: new Date().toISOString(),
-                            browserData: collectBrowserData()
-                        })
-                    });
-                })();
-            '''
-
-        @app.route('/event', methods=['POST'])
-        def track_event():
-            # Store analytics data
-            data = request.get_json()
-            stored_data.append(data)
-            return jsonify({'status': 'success'})
+            return self._send_script('analytics.js')
 
-        self.apps['analytics'] = app
+        @bp.route('/event', methods=['POST'])
+        def track_event():
+            # Queue analytics data, shedding load when the flusher falls behind
+            if len(event_queue) >= _EVENT_QUEUE_LIMIT:
+                return _EVENT_BUSY
+            length = request.content_length
+            if length and length > _MAX_EVENT_BYTES:
+                return _EVENT_TOO_LARGE
+            # Parse the raw stream: no copy cached on request.data and no
+            # mimetype check, since every caller posts JSON
+            try:
+                data = _json_loads(request.stream.read(length or _MAX_EVENT_BYTES))
+            except ValueError:
+                return _EVENT_INVALID
+            event_queue.append(data)
+            return _EVENT_ACCEPTED
+
+        self._register_site('analytics', bp)
 
     def run(self):
         """Run all test sites on different ports"""
         from threading import Thread
 
-        def run_app(app, port):
-            app.run(port=port)
-
-        threads = []
-        for i, (name, app) in enumerate(self.apps.items()):
-            port = self.port_start + i
-            thread = Thread(target=run_app, args=(app, port))
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
+        sites = [(name, _mount(self.app, prefix), self.port_start + i)
+                 for i, (name, prefix) in enumerate(self.sites.items())]
+
+        def serve_threaded(app, port):
+            # Fallbacks when gevent is missing, the dev server only as a last resort
+            if waitress is not None:
+                waitress.serve(app, host='127.0.0.1', port=port,
+                               threads=_WAITRESS_THREADS)
+            else:
+                from werkzeug.serving import run_simple
+                run_simple('127.0.0.1', port, app, threaded=True)
+
+        if WSGIServer is None:
+            for name, app, port in sites:
+                thread = Thread(target=serve_threaded, args=(app, port))
+                thread.daemon = True
+                thread.start()
+                print(f"Started {name} site on port {port}")
+            return
+
+        # Extra workers bind their own SO_REUSEPORT sockets, so accepts are
+        # balanced by the kernel rather than contended in one process
+        context = multiprocessing.get_context('fork')
+        for _ in range(self.workers - 1):
+            context.Process(target=self._run_worker, args=(sites,),
+                            daemon=True).start()
+
+        thread = Thread(target=self._serve_sites, args=(sites,))
+        thread.daemon = True
+        thread.start()
+        for name, _, port in sites:
             print(f"Started {name} site on port {port}")
+
+    def _serve_sites(self, sites):
+        """Serve every site from one gevent hub on the calling thread"""
+        # Servers are started here so they all bind to this thread's
+        # hub; one accept loop then covers every site
+        servers = [WSGIServer(_listen_socket(port), app,
+                              log=None, error_log=None)
+                   for _, app, port in sites]
+        for server in servers:
+            server.start()
+        servers[-1].serve_forever()
+
+    def cleanup(self):
+        """Remove the generated script files"""
+        self._js_tmp.cleanup()
+
+    def _run_worker(self, sites):
+        """Entry point of an additional worker process"""
+        # Only the forking thread survives fork, so restart the flusher
+        self._start_event_flusher()
+        self._serve_sites(sites)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The source modules import each other by bare name, as the scripts do
+# when run from their own directories
+_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+for package in ('analysis', 'blocking', 'monitors', 'test_sites'):
+    sys.path.insert(0, os.path.join(_SRC, package))
@@ -0,0 +1,32 @@
+import threading
+
+import pytest
+
+from blocking_rules_manager import HyperscanMatcher
+
+
+def test_hyperscan_matcher_is_safe_to_share_across_threads():
+    pytest.importorskip('hyperscan')
+    matcher = HyperscanMatcher([(1, r'(analytics|tracking)'), (2, r'beacon\d+')])
+    # Long inputs keep every scan in flight long enough to overlap
+    data = 'x' * 200_000 + 'tracking'
+    threads = 8
+    barrier = threading.Barrier(threads)
+    errors, results = [], []
+
+    def scan():
+        barrier.wait()
+        try:
+            for _ in range(20):
+                results.append(matcher.search(data))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=scan) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert results == [[1]] * (threads * 20)
@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip('seleniumwire')
+
+from browser_session import SharedBrowserSession
+
+
+class FakeDriver:
+    def __init__(self):
+        self.cdp_calls = []
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp_calls.append((cmd, params))
+
+
+class OfflineSession(SharedBrowserSession):
+    def setup_browser(self):
+        self.driver = FakeDriver()
+
+
+def test_each_init_script_is_registered_separately():
+    session = OfflineSession()
+    session.add_init_script('throw new Error("broken monitor");')
+    session.add_init_script('window.hooked = true;')
+    session.install_init_scripts()
+
+    assert session.driver.cdp_calls == [
+        ('Page.addScriptToEvaluateOnNewDocument',
+         {'source': 'throw new Error("broken monitor");'}),
+        ('Page.addScriptToEvaluateOnNewDocument',
+         {'source': 'window.hooked = true;'}),
+    ]
+
+    session.install_init_scripts()
+    assert len(session.driver.cdp_calls) == 2
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('seleniumwire')
+
+from cookie_monitor import CookieMonitor
+
+
+class FakeSession:
+    def __init__(self):
+        self.driver = type('FakeDriver', (), {'current_url': 'https://site.example/'})()
+
+    def add_init_script(self, source):
+        pass
+
+
+def test_respawn_lookups_are_index_searches(tmp_path):
+    monitor = CookieMonitor(str(tmp_path / 'cookies.db'), session=FakeSession())
+    monitor._store_cookie({'name': 'uid'})
+    monitor._conn.execute('UPDATE cookies SET is_deleted = 1')
+    monitor._store_cookie({'name': 'uid'})
+
+    statements = []
+    monitor._conn.set_trace_callback(statements.append)
+    assert monitor.detect_respawning('uid')
+    monitor._conn.set_trace_callback(None)
+
+    plans = [monitor._conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+             for sql in statements if sql.lstrip().startswith('SELECT')]
+    monitor.cleanup()
+
+    details = [[row[3] for row in plan] for plan in plans]
+    assert details == [
+        ['SEARCH cookies USING COVERING INDEX idx_cookies_name_deleted '
+         '(name=? AND is_deleted=?)'],
+        ['SEARCH cookies USING COVERING INDEX idx_cookies_name_created '
+         '(name=? AND creation_time>?)'],
+    ]
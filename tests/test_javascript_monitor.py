@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+pytest.importorskip('seleniumwire')
+
+from selenium.webdriver.common.bidi import cdp
+
+import javascript_monitor
+from javascript_monitor import JavaScriptMonitor
+
+
+class FakeDevToolsConnection:
+    """Stands in for selenium's WebSocketConnection without a browser"""
+
+    def __init__(self):
+        self.commands = []
+        self.callbacks = {}
+
+    def execute(self, command):
+        self.commands.append(next(command))
+
+    def add_callback(self, event, callback):
+        self.callbacks.setdefault(event.event_class, []).append(callback)
+        return id(callback)
+
+    def remove_callback(self, event, callback_id):
+        self.callbacks[event.event_class] = [
+            cb for cb in self.callbacks[event.event_class] if id(cb) != callback_id]
+
+    def emit(self, method, params):
+        """Deliver a CDP event the way WebSocketConnection does"""
+        event = cdp.import_devtools('latest').util._event_parsers[method]
+        for callback in self.callbacks.get(method, []):
+            callback(event.from_json(params))
+
+
+class FakeDriver:
+    def __init__(self):
+        self.connection = FakeDevToolsConnection()
+
+    def start_devtools(self):
+        return cdp.import_devtools('latest'), self.connection
+
+
+class FakeSession:
+    def __init__(self):
+        self.driver = FakeDriver()
+        self.scripts = []
+
+    def add_init_script(self, source):
+        self.scripts.append(source)
+
+
+def test_binding_call_reaches_database(tmp_path):
+    session = FakeSession()
+    monitor = JavaScriptMonitor(str(tmp_path / 'js.db'), session=session)
+    connection = session.driver.connection
+    assert {'method': 'Runtime.addBinding',
+            'params': {'name': javascript_monitor._BINDING_NAME}} in connection.commands
+
+    payload = {
+        'doc': 'd1',
+        'origin': 1_700_000_000_000.0,
+        'strings': ['https://tracker.example/fp.js', 'key'],
+        'records': [5, 0, -1, 10, -1, 1, 0, 1, 20, -1],
+        'end': True
+    }
+    connection.emit('Runtime.bindingCalled', {
+        'name': javascript_monitor._BINDING_NAME,
+        'payload': json.dumps(payload),
+        'executionContextId': 1
+    })
+    result = monitor.analyze_script_behavior()
+    rows = monitor._conn.execute('''
+        SELECT timestamp, script_url, function_name, accessed_data, is_suspicious
+        FROM js_activities ORDER BY timestamp
+    ''').fetchall()
+    monitor.cleanup()
+
+    assert rows == [
+        (1_700_000_000_010_000_000, 'https://tracker.example/fp.js', 'getImageData', None, 1),
+        (1_700_000_000_020_000_000, 'https://tracker.example/fp.js', 'setItem', 'key', 0),
+    ]
+    assert result['suspicious_activities'] == [
+        ('https://tracker.example/fp.js', 1, 'getImageData')]
+    assert not connection.callbacks['Runtime.bindingCalled']
+
+
+def test_other_bindings_and_bad_payloads_are_ignored(tmp_path):
+    session = FakeSession()
+    monitor = JavaScriptMonitor(str(tmp_path / 'js.db'), session=session)
+    connection = session.driver.connection
+    connection.emit('Runtime.bindingCalled', {
+        'name': 'somethingElse', 'payload': '{}', 'executionContextId': 1})
+    connection.emit('Runtime.bindingCalled', {
+        'name': javascript_monitor._BINDING_NAME, 'payload': 'not json',
+        'executionContextId': 1})
+    monitor.flush()
+    count, = monitor._conn.execute('SELECT COUNT(*) FROM js_activities').fetchone()
+    monitor.cleanup()
+
+    assert count == 0
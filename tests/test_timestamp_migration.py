@@ -0,0 +1,80 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('seleniumwire')
+
+from cookie_monitor import CookieMonitor
+from storage_monitor import StorageMonitor
+
+
+class FakeSession:
+    """Hands monitors a browser-less driver and swallows their hooks"""
+
+    def __init__(self):
+        self.driver = type('FakeDriver', (), {'current_url': 'https://site.example/'})()
+
+    def add_init_script(self, source):
+        pass
+
+    def add_response_interceptor(self, callback):
+        pass
+
+
+def _legacy_db(path, schema, rows_sql, rows):
+    """A database as the pre-nanosecond monitors left it"""
+    conn = sqlite3.connect(path)
+    conn.execute(schema)
+    conn.executemany(rows_sql, rows)
+    conn.commit()
+    conn.close()
+
+
+def test_cookie_creation_times_are_converted(tmp_path):
+    db = str(tmp_path / 'cookies.db')
+    # datetime.now() went through sqlite3's default adapter as local ISO text
+    deleted_at = str(datetime.now() - timedelta(hours=1))
+    _legacy_db(db, '''
+        CREATE TABLE cookies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            domain TEXT, name TEXT, value TEXT, path TEXT,
+            expires TIMESTAMP, secure INTEGER, http_only INTEGER,
+            same_site TEXT, source_url TEXT, creation_time TIMESTAMP,
+            last_accessed TIMESTAMP, is_session INTEGER,
+            is_deleted INTEGER DEFAULT 0
+        )
+    ''', 'INSERT INTO cookies (name, creation_time, is_deleted) VALUES (?, ?, ?)',
+        [('uid', deleted_at, 1)])
+
+    monitor = CookieMonitor(db, session=FakeSession())
+    monitor._store_cookie({'name': 'uid', 'domain': 'tracker.example'})
+    types = monitor._conn.execute(
+        'SELECT DISTINCT typeof(creation_time) FROM cookies').fetchall()
+    respawned = monitor.detect_respawning('uid')
+    monitor.cleanup()
+
+    assert types == [('integer',)]
+    assert respawned
+
+
+def test_storage_timestamps_are_converted(tmp_path):
+    db = str(tmp_path / 'storage.db')
+    _legacy_db(db, '''
+        CREATE TABLE etags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT, etag TEXT, timestamp TIMESTAMP, response_headers TEXT
+        )
+    ''', 'INSERT INTO etags (url, etag, timestamp) VALUES (?, ?, ?)',
+        [('https://t.example/p.gif', 'old', str(datetime.now() - timedelta(hours=1)))])
+
+    monitor = StorageMonitor(db, session=FakeSession())
+    monitor._store_etag('https://t.example/p.gif', 'new', {})
+    monitor.flush()
+    etags = monitor._conn.execute(
+        'SELECT etag, typeof(timestamp) FROM etags ORDER BY timestamp').fetchall()
+    version, = monitor._conn.execute('PRAGMA user_version').fetchone()
+    monitor.cleanup()
+
+    assert etags == [('old', 'integer'), ('new', 'integer')]
+    assert version == 1
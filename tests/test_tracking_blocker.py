@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip('seleniumwire')
+
+from blocking_rules_manager import BlockingRulesManager
+from tracking_blocker import TrackingBlocker
+
+
+class OfflineBlocker(TrackingBlocker):
+    """TrackingBlocker whose interceptors are driven without a browser"""
+
+    def setup_browser(self):
+        self.driver = None
+
+
+class FakeRequest:
+    def __init__(self, url):
+        self.url = url
+        self.method = 'GET'
+        self.headers = {}
+        self.body = b''
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+@pytest.fixture
+def blocker(tmp_path):
+    rules_db = str(tmp_path / 'rules.db')
+    BlockingRulesManager(rules_db).add_default_rules()
+    blocker = OfflineBlocker(rules_db, str(tmp_path / 'logs.db'))
+    yield blocker
+    blocker.flush_logs()
+
+
+def test_bulk_add_rule_rebuilds_prefilters_once(blocker, monkeypatch):
+    builds = []
+    build_matcher = blocker._rules_manager.build_matcher
+    monkeypatch.setattr(blocker._rules_manager, 'build_matcher',
+                        lambda: builds.append(1) or build_matcher())
+
+    for i in range(50):
+        blocker.add_rule('url', rf'bulk{i}\.example', 'block', 'bulk')
+    assert builds == []
+
+    request = FakeRequest('https://bulk49.example/pixel')
+    blocker._intercept_request(request)
+    assert request.aborted
+    assert len(builds) == 1
+
+    clean = FakeRequest('https://clean.example/')
+    blocker._intercept_request(clean)
+    assert not clean.aborted
+    assert len(builds) == 1
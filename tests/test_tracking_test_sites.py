@@ -0,0 +1,43 @@
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+
+import pytest
+
+pytest.importorskip('orjson')
+flask = pytest.importorskip('flask')
+from flask.json.provider import DefaultJSONProvider
+
+from tracking_test_sites import _install_orjson_provider
+
+
+def test_orjson_provider_encodes_like_flask():
+    app = flask.Flask(__name__)
+    _install_orjson_provider(app)
+    payload = {
+        'zeta': 1,
+        'alpha': {'seen': datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc),
+                  'day': date(2024, 5, 1)},
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'events': [{'b': 2, 'a': 1}]
+    }
+
+    encoded = app.json.dumps(payload)
+    expected = DefaultJSONProvider(app).dumps(payload)
+
+    assert json.loads(encoded) == json.loads(expected)
+    assert json.loads(encoded)['alpha']['seen'] == 'Wed, 01 May 2024 12:30:00 GMT'
+    assert list(json.loads(encoded)) == ['alpha', 'events', 'id', 'zeta']
+
+
+def test_cleanup_removes_precompressed_scripts():
+    from tracking_test_sites import TrackingTestSites
+
+    sites = TrackingTestSites(port_start=0)
+    js_dir = sites._js_dir
+    assert sorted(os.listdir(js_dir)) == [
+        'analytics.js', 'analytics.js.gz', 'tracker.js', 'tracker.js.gz']
+
+    sites.cleanup()
+    assert not os.path.exists(js_dir)